@@ -0,0 +1,216 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Benchmarks each output path of the logs exporter on synthetic logs.
+
+Log records are generated by wa_logs/synthetic.py in the same shape that the
+exporters download, then written by each output path. Every path and size runs
+in its own process, so that peak RSS belongs to that run alone. Reported per run:
+* records/s  records divided by the time spent converting and writing, not generating.
+* peak RSS   the most memory the process held, including the downloaded pages the
+             in-memory paths keep, as the exporter does.
+* output     size of the file written.
+
+Paths: dataframe (convert only), json, jsonl, jsonl.gz, csv, csv-sorted (on disk
+sort, see --sortmemory), xlsx, xlsx-stream (constant memory) and parquet.
+Peak RSS needs the resource module, so this runs on Linux and macOS.
+
+Example command lines:
+* python benchmark_export.py
+* python benchmark_export.py --sizes 10k,1m --paths csv,csv-sorted,parquet --report bench.json
+* python benchmark_export.py --sizes 10m --paths jsonl,parquet,csv-sorted --contextsize 60
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from wa_logs.synthetic import LogSet
+
+C_DATAFRAME = 'dataframe'
+C_JSON = 'json'
+C_JSONL = 'jsonl'
+C_JSONL_GZ = 'jsonl.gz'
+C_CSV = 'csv'
+C_CSV_SORTED = 'csv-sorted'
+C_XLSX = 'xlsx'
+C_XLSX_STREAM = 'xlsx-stream'
+C_PARQUET = 'parquet'
+
+all_paths = [C_DATAFRAME, C_JSON, C_JSONL, C_JSONL_GZ, C_CSV, C_CSV_SORTED, C_XLSX, C_XLSX_STREAM, C_PARQUET]
+
+# These hold the whole export in memory before writing, the rest write page by page.
+in_memory_paths = [C_DATAFRAME, C_JSON, C_CSV, C_XLSX]
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--sizes', help='Comma separated record counts, k and m suffixes allowed. Default is 10k.',
+                    type=str, default='10k')
+parser.add_argument('--paths', help='Comma separated output paths to run. Default is all of: ' + ', '.join(all_paths),
+                    type=str, default=','.join(all_paths))
+parser.add_argument('--pagelimit', help='Records per page. Default is 200.', type=int, default=200)
+parser.add_argument('--contextsize', help='Extra skill variables per context. Default is 20.', type=int, default=20)
+parser.add_argument('--sortmemory', help='MB of memory for csv-sorted. Default is 256.', type=int, default=256)
+parser.add_argument('--outdir', help='Folder to write output files to. Default is a temporary folder.',
+                    type=str, default=None)
+parser.add_argument('--keep', help='Keep the output files.', action='store_true')
+parser.add_argument('--report', help='Also write the results to this JSON file.', type=str, default=None)
+parser.add_argument('--seed', help='Seed for the synthetic logs. Default is 0.', type=int, default=0)
+parser.add_argument('--run', help=argparse.SUPPRESS, type=str, default=None)
+parser.add_argument('--records', help=argparse.SUPPRESS, type=int, default=None)
+
+
+def parse_size(value=''):
+    value = value.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    return int(float(value.rstrip('km')) * multiplier)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def timed_pages(logs=None, page_limit=200, clock=None):
+    """ Yields pages, adding the time spent generating them to clock[0]. """
+    pages = logs.pages(page_limit)
+    while True:
+        started = time.perf_counter()
+        page = next(pages, None)
+        clock[0] += time.perf_counter() - started
+        if page is None:
+            return
+        yield page
+
+
+def run_path(path=None, records=0, args=None):
+    """ Runs one output path in this process and returns its measurements. """
+    from wa_logs import writers
+    from wa_logs.extsort import ExternalSorter
+    from wa_logs.flatten import convert_json_to_dataframe, csv_rows, xlsx_rows
+
+    logs = LogSet(count=records, context_size=args.contextsize, seed=args.seed)
+    extension = {C_CSV_SORTED: 'csv', C_XLSX_STREAM: 'xlsx'}.get(path, path)
+    file_name = os.path.join(args.outdir, 'benchmark_{}.{}'.format(records, extension))
+    clock = [0.0]
+    started = time.perf_counter()
+
+    if path in in_memory_paths:
+        data = list(timed_pages(logs, args.pagelimit, clock))
+        if path == C_DATAFRAME:
+            convert_json_to_dataframe(data)
+            file_name = None
+        elif path == C_JSON:
+            writers.save_json(data=data, file_name=file_name)
+        elif path == C_CSV:
+            writers.save_xsv(data=data, file_name=file_name)
+        elif path == C_XLSX:
+            writers.save_xlsx(data=data, file_name=file_name)
+
+    elif path in [C_JSONL, C_JSONL_GZ]:
+        with writers.open_jsonl(file_name=file_name, compress=path == C_JSONL_GZ) as out:
+            for page in timed_pages(logs, args.pagelimit, clock):
+                writers.save_jsonl_page(data=page, out=out)
+
+    elif path == C_CSV_SORTED:
+        with ExternalSorter(key=lambda row: (row[0], row[1]), memory=args.sortmemory * 1024 * 1024,
+                            temp_dir=args.outdir) as sorter:
+            for page in timed_pages(logs, args.pagelimit, clock):
+                sorter.add(csv_rows(page))
+            writers.save_xsv_sorted(sorter=sorter, file_name=file_name)
+
+    elif path == C_XLSX_STREAM:
+        writer = writers.XlsxStreamWriter(file_name=file_name)
+        for page in timed_pages(logs, args.pagelimit, clock):
+            writer.add_rows(xlsx_rows(page))
+        writer.close()
+
+    elif path == C_PARQUET:
+        writer = writers.open_parquet(file_name=file_name)
+        for page in timed_pages(logs, args.pagelimit, clock):
+            writers.save_parquet_page(data=page, writer=writer)
+        writer.close()
+
+    seconds = time.perf_counter() - started - clock[0]
+    size = os.path.getsize(file_name) if file_name is not None else 0
+    if file_name is not None and not args.keep:
+        os.remove(file_name)
+
+    return {
+        'path': path, 'records': records, 'seconds': round(seconds, 3),
+        'generate_seconds': round(clock[0], 3),
+        'records_per_second': round(records / seconds) if seconds > 0 else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1), 'output_mb': round(size / (1024 * 1024), 2)
+    }
+
+
+def run_in_child(path=None, records=0, args=None):
+    command = [sys.executable, os.path.abspath(__file__), '--run', path, '--records', str(records),
+               '--pagelimit', str(args.pagelimit), '--contextsize', str(args.contextsize),
+               '--sortmemory', str(args.sortmemory), '--outdir', args.outdir, '--seed', str(args.seed)]
+    if args.keep:
+        command.append('--keep')
+
+    done = subprocess.run(command, stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if done.returncode != 0:
+        return {'path': path, 'records': records, 'error': f'exit code {done.returncode}'}
+    return json.loads(done.stdout.decode('utf8').strip().splitlines()[-1])
+
+
+def print_result(result=None):
+    if 'error' in result:
+        print('{:<11} {:>11,} {}'.format(result['path'], result['records'], result['error']))
+        return
+
+    print('{:<11} {:>11,} {:>9.2f}s {:>12,} rec/s {:>9.1f} MB RSS {:>10.2f} MB out'.format(
+        result['path'], result['records'], result['seconds'], result['records_per_second'] or 0,
+        result['peak_rss_mb'], result['output_mb']))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    if args.run is not None:
+        print(json.dumps(run_path(path=args.run, records=args.records, args=args)))
+        sys.exit(0)
+
+    temp_dir = None
+    if args.outdir is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix='wa_logs_benchmark_')
+        args.outdir = temp_dir.name
+
+    paths = [path.strip() for path in args.paths.split(',') if path.strip()]
+    unknown = [path for path in paths if path not in all_paths]
+    if unknown:
+        print('Error: unknown paths {}. Exiting.'.format(', '.join(unknown)))
+        sys.exit(1)
+
+    results = []
+    for records in [parse_size(size) for size in args.sizes.split(',')]:
+        print(f'Benchmarking {records:,} records, context size {args.contextsize}.')
+        for path in paths:
+            result = run_in_child(path=path, records=records, args=args)
+            print_result(result)
+            results.append(result)
+
+    if args.report is not None:
+        with open(args.report, 'w') as out:
+            json.dump(results, out, indent=2)
+
+    if temp_dir is not None:
+        temp_dir.cleanup()
@@ -0,0 +1,111 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Compares the original convert_json_to_dataframe with the batched one in wa_logs.flatten.
+
+Builds synthetic log pages in memory with wa_logs.synthetic, converts them with both functions, checks
+that the results match and prints the time each one took.
+
+Example command lines:
+* python benchmark_flatten.py
+* python benchmark_flatten.py --records 1000000 --nocontext
+"""
+
+import argparse
+import json
+import time
+import pandas as pd
+from wa_logs import flatten
+from wa_logs.synthetic import LogSet
+from wa_logs.flatten import (columns, f_conversation_id, f_request_timestamp, f_response_timestamp,
+                             f_user_input, f_output, f_intent, f_confidence, f_exit_reason, f_logging, f_context)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', help='Number of log records to convert. Default is 100000.', type=int, default=100000)
+parser.add_argument('--pagelimit', help='Records per page. Default is 200.', type=int, default=200)
+parser.add_argument('--nocontext', help='Also time the batched conversion without the Context column.', action='store_true')
+parser.add_argument('--contextsize', help='Extra skill variables per context. Default is 20.', type=int, default=20)
+parser.add_argument('--seed', help='Seed for the synthetic logs. Default is 0.', type=int, default=0)
+
+
+def legacy_convert_json_to_dataframe(data=None):
+    # The per-row conversion this benchmark compares against, kept as it was.
+    rows = []
+
+    if data == [[]]:
+        print('No Logs found. :(')
+        return None
+
+    for data_records in data:
+        for o in data_records:
+            row = {}
+
+            r = o['response']
+            s = r['context']['system']
+
+            row[f_conversation_id] = r['context'][f_conversation_id]
+            row[f_request_timestamp] = o[f_request_timestamp]
+            row[f_response_timestamp] = o[f_response_timestamp]
+
+            if 'text' in r['input']:
+                row[f_user_input] = r['input']['text']
+
+            if 'text' in r['output']:
+                row[f_output] = ' '.join(r['output']['text'])
+
+            if len(r['intents']) > 0:
+                row[f_confidence] = r['intents'][0]['confidence']
+                row[f_intent] = r['intents'][0]['intent']
+
+            if 'branch_exited_reason' in s:
+                row[f_exit_reason] = s['branch_exited_reason']
+
+            if 'log_messaging' in r['output']:
+                row[f_logging] = r['output']['log_messaging']
+
+            row[f_context] = json.dumps(r['context'])
+
+            rows.append(row)
+
+    df = pd.DataFrame(rows, columns=columns)
+    df = df.fillna('')
+    df[f_request_timestamp] = pd.to_datetime(df[f_request_timestamp])
+    df[f_response_timestamp] = pd.to_datetime(df[f_response_timestamp])
+    df = df.sort_values([f_conversation_id, f_request_timestamp], ascending=[True, True])
+
+    return df
+
+
+def timed(label=None, records=0, function=None):
+    started = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - started
+    print('{:<28} {:8.3f}s {:12,.0f} records/s'.format(label, elapsed, records / elapsed if elapsed else 0))
+    return result, elapsed
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    print(f'Building {args.records} synthetic records.')
+    pages = list(LogSet(count=args.records, context_size=args.contextsize, seed=args.seed).pages(args.pagelimit))
+
+    legacy, legacy_time = timed('legacy', args.records, lambda: legacy_convert_json_to_dataframe(pages))
+    batched, batched_time = timed('batched', args.records, lambda: flatten.convert_json_to_dataframe(pages))
+    if args.nocontext:
+        timed('batched, no context', args.records, lambda: flatten.convert_json_to_dataframe(pages, context=False))
+
+    print('Speed up: {:.2f}x'.format(legacy_time / batched_time))
+    # Compare what ends up in the CSV, as an all empty column can get a different dtype.
+    print('Same CSV output: {}'.format(legacy.to_csv(index=False) == batched.to_csv(index=False)))
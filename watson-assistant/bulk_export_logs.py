@@ -0,0 +1,224 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Exports the logs of many workspaces, assistants and deployments in one run.
+
+The manifest is a CSV file with an id column, and optionally logtype, language,
+filter and name columns. Lines whose id starts with ; are skipped. For example:
+
+    id,logtype,name
+    0a0c06c1-8e31-4655-9067-58fcac5134fc,WORKSPACE,pizza
+    9f8e7d6c-1b2a-4c3d-8e9f-0a1b2c3d4e5f,ASSISTANT,travel-assistant
+
+Each ID is written to its own file in the output folder, named after the name
+column, or the ID if there is none. --workers IDs download at the same time,
+sharing one connection pool and one rate limit, so adding workers does not
+multiply the load on the service. An ID that fails is reported and does not stop
+the others. The script exits with 1 if any ID failed.
+
+With --incremental, each ID keeps a state file next to its output, and only logs
+newer than its last completed export are pulled.
+
+Example command lines:
+* python bulk_export_logs.py apikey manifest.csv exports --filetype JSONL --workers 8 --url service_url
+* python bulk_export_logs.py apikey manifest.csv nightly --filetype CSV --incremental --report nightly/report.json
+"""
+
+import argparse
+import logging
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wa_logs.exporter import (C_CSV, C_JSON, C_JSONL, C_PARQUET, C_SQLITE, C_TSV, C_WORKSPACE, C_XLSX, c_CURSOR,
+                              c_FILENAME, c_FILTER, c_SINCE, connect, default_language, default_url, default_version,
+                              export, file_types, load_state, log_filter, log_pages, open_writer, since_filter)
+from wa_logs.projection import load_projection
+from wa_logs.retry import RateLimiter, default_retries
+
+c_ID = 'id'
+c_LOGTYPE = 'logtype'
+c_LANGUAGE = 'language'
+c_NAME = 'name'
+
+file_extensions = {C_CSV: '.csv', C_TSV: '.tsv', C_XLSX: '.xlsx', C_JSON: '.json', C_JSONL: '.jsonl',
+                   C_PARQUET: '.parquet', C_SQLITE: '.db'}
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('apikey', help='Watson Assistant API Key.', type=str)
+    parser.add_argument('manifest', help='CSV file of the IDs to export, with an id column and optionally logtype, '
+                        'language, filter and name columns.', type=str)
+    parser.add_argument('outdir', help='Folder to write an output file per ID to. It is created if needed.', type=str)
+    parser.add_argument('--filetype', help=f'Output file type. Default is {C_JSONL}.', type=str, default=C_JSONL,
+                        choices=file_types)
+    parser.add_argument('--url', help=f'Default is {default_url}.', type=str, default=default_url)
+    parser.add_argument('--iamurl', help='IAM token service URL. Default is the IBM Cloud one.', type=str, default=None)
+    parser.add_argument('--version', help=f'Default is {default_version}.', type=str, default=default_version)
+    parser.add_argument('--language', help=f'Language for IDs without one in the manifest. Default is {default_language}.',
+                        type=str, default=default_language)
+    parser.add_argument('--totalpages', help='Maximum number of pages to pull per ID. Default is 999', type=int, default=999)
+    parser.add_argument('--pagelimit', help='Maximum number of records to a page. Default is 200.', type=int, default=200)
+    parser.add_argument('--workers', help='Number of IDs to export at the same time. Default is 4.', type=int, default=4)
+    parser.add_argument('--retries', help=f'Times to retry a throttled or failed page. Default is {default_retries}.',
+                        type=int, default=default_retries)
+    parser.add_argument('--rate', help='Pages per second to start at, across all workers. This goes up while requests '
+                        'succeed and halves when throttled. Default is 5.', type=float, default=5.0)
+    parser.add_argument('--maxrate', help='Never request more than this many pages per second across all workers. '
+                        'Default is no limit.', type=float, default=None)
+    parser.add_argument('--incremental', help='Only pull logs newer than the last completed export of each ID.',
+                        action='store_true')
+    parser.add_argument('--nocontext', help='Leave the Context column empty. Default is false.', action='store_true')
+    parser.add_argument('--sortmemory', help=f'Sort {C_CSV}/{C_TSV}/{C_XLSX} output on disk using about this many MB '
+                        'of memory per worker. Default is to sort in memory.', type=int, default=None)
+    parser.add_argument('--tempdir', help='Folder for the temporary files used by --sortmemory.', type=str, default=None)
+    parser.add_argument('--columns', help='JSON file listing the columns to export, as in export_logs_py.py.',
+                        type=str, default=None)
+    parser.add_argument('--gzip', help=f'Gzip {C_JSONL} output while streaming. Default is false.', action='store_true')
+    parser.add_argument('--report', help='Also write the outcome of every ID to this JSON file.', type=str, default=None)
+    return parser.parse_args()
+
+
+def read_manifest(file_name=None, language=default_language):
+    """ Reads the manifest into a list of dicts with the id, name and filter of each export.
+    Raises ValueError if a line cannot be exported.
+    """
+    exports = []
+    with open(file_name, newline='') as f:
+        for line, row in enumerate(csv.DictReader(f), 2):
+            id = (row.get(c_ID) or '').strip()
+            if not id or id[:1] == ';':
+                continue
+
+            pull_filter = (row.get(c_FILTER) or '').strip()
+            if not pull_filter:
+                try:
+                    pull_filter = log_filter(log_type=(row.get(c_LOGTYPE) or C_WORKSPACE).strip(), id=id,
+                                             language=(row.get(c_LANGUAGE) or language).strip())
+                except ValueError as error:
+                    raise ValueError(f'line {line}: {error}')
+
+            exports.append({c_ID: id, c_NAME: (row.get(c_NAME) or id).strip(), c_FILTER: pull_filter})
+
+    names = [export[c_NAME] for export in exports]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise ValueError('names must be unique, not {}.'.format(', '.join(duplicates)))
+    return exports
+
+
+def export_one(entry=None, client=None, limiter=None, projection=None, args=None):
+    """ Exports one manifest entry. Returns the number of records written. """
+    file_name = os.path.join(args.outdir, entry[c_NAME] + file_extensions[args.filetype])
+    if args.filetype == C_JSONL and args.gzip:
+        file_name = file_name + '.gz'
+    entry[c_FILENAME] = file_name
+
+    pull_filter = entry[c_FILTER]
+    state = None
+    state_file = None
+    if args.incremental:
+        state_file = os.path.join(args.outdir, entry[c_NAME] + '.state')
+        state = load_state(state_file)
+        if state.get(c_SINCE):
+            pull_filter = since_filter(pull_filter, state[c_SINCE])
+        state[c_FILTER] = pull_filter
+        state[c_FILENAME] = file_name
+        state[c_CURSOR] = None
+
+    writer = open_writer(file_type=args.filetype, file_name=file_name, context=not args.nocontext,
+                         sort_memory=args.sortmemory * 1024 * 1024 if args.sortmemory is not None else None,
+                         temp_dir=args.tempdir, compress=args.gzip, projection=projection)
+    pages = log_pages(client=client, pull_filter=pull_filter, page_limit=args.pagelimit, total_pages=args.totalpages,
+                      limiter=limiter, retries=args.retries, progress=state, label=' of {}'.format(entry[c_NAME]))
+    return export(pages=pages, writer=writer, state=state, state_file=state_file)
+
+
+def main():
+    args = parse_arguments()
+    args.filetype = args.filetype.upper()
+
+    try:
+        exports = read_manifest(args.manifest, language=args.language)
+    except (OSError, ValueError) as error:
+        print(f'Error: manifest {error} Exiting.')
+        exit(1)
+
+    projection = None
+    if args.columns is not None:
+        try:
+            projection = load_projection(args.columns)
+        except (OSError, ValueError) as error:
+            print(f'Error: --columns {error} Exiting.')
+            exit(1)
+
+    os.makedirs(args.outdir, exist_ok=True)
+
+    # One client and one rate limit for every worker.
+    client = connect(apikey=args.apikey, url=args.url, version=args.version, iam_url=args.iamurl,
+                     pool_size=max(args.workers, 10))
+    limiter = RateLimiter(rate=args.rate, max_rate=args.maxrate)
+
+    print(f'Exporting {len(exports)} ID(s) to {args.outdir} with {args.workers} worker(s).')
+    lock = threading.Lock()
+    done = []
+    started = time.time()
+
+    def run(entry):
+        entry_started = time.time()
+        try:
+            entry['records'] = export_one(entry=entry, client=client, limiter=limiter, projection=projection, args=args)
+            entry['error'] = None
+        except Exception as error:
+            entry['records'] = None
+            entry['error'] = '{}: {}'.format(type(error).__name__, error)
+        entry['seconds'] = round(time.time() - entry_started, 2)
+
+        with lock:
+            done.append(entry)
+            if entry['error'] is None:
+                print('[{}/{}] {}: {} records in {}s.'.format(len(done), len(exports), entry[c_NAME], entry['records'],
+                                                             entry['seconds']))
+            else:
+                print('[{}/{}] {}: failed. {}'.format(len(done), len(exports), entry[c_NAME], entry['error']))
+
+    with ThreadPoolExecutor(max_workers=max(args.workers, 1)) as pool:
+        for future in [pool.submit(run, entry) for entry in exports]:
+            future.result()
+
+    failed = [entry for entry in exports if entry['error'] is not None]
+    records = sum(entry['records'] for entry in exports if entry['error'] is None)
+    elapsed = time.time() - started
+    print('Exported {} records from {} of {} ID(s) in {:.1f}s.'.format(records, len(exports) - len(failed), len(exports),
+                                                                     elapsed))
+    for entry in failed:
+        print('  {} failed: {}'.format(entry[c_NAME], entry['error']))
+
+    if args.report is not None:
+        with open(args.report, 'w') as out:
+            json.dump({'records': records, 'seconds': round(elapsed, 2), 'failed': len(failed), 'exports': exports},
+                      out, indent=2)
+
+    if failed:
+        exit(1)
+
+
+if __name__ == '__main__':
+    # The wa_logs modules report progress through logging.
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stdout)
+    main()
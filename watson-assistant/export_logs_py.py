@@ -31,46 +31,93 @@ Just run the program for the command line options.
 * Using the filter option will negate the following settings and you have to set yourself
     * language, logtype, id.
 * If you scroll down you can hard code your defaults easily.
+* JSONL writes each page to disk as it is downloaded, one log per line. Memory stays at
+  roughly one page regardless of export size. Add --gzip to compress while streaming.
+* SQLITE upserts logs by log_id into a local SQLite database as pages arrive, with indexes on
+  conversation, request time, intent and exit reason. Exporting into the same file again adds
+  new logs and updates old ones, so --incremental grows one queryable store. See wa_logs/store.py.
+* PARQUET is also written as pages arrive, one row group per page, with typed timestamp and
+  confidence columns. It needs pyarrow installed. Rows are left in download order.
+* --nocontext leaves the Context column empty. Serializing every context is most of the cost
+  of building CSV/TSV/XLSX/PARQUET output, see benchmark_flatten.py.
+* --context REF writes each distinct part of a context once to a sidecar file (--contextfile)
+  and leaves only a hash in the Context column. --context DIFF writes the first turn of each
+  conversation in full and later turns as the changes from the turn before. Both are read
+  back with the functions in wa_logs/contexts.py.
+* --columns reads a JSON list of dotted paths into the log records, with optional names and
+  defaults, and writes just those columns to CSV/TSV/XLSX, or just those fields to JSONL. See
+  wa_logs/projection.py for the format.
+* --sortmemory sorts CSV/TSV output on disk instead of in one DataFrame. Pages are spilled to
+  sorted temporary files once the memory budget is used, then merged into the output file.
+* Throttling (429), server errors and dropped connections are retried with backoff, honouring
+  Retry-After. Calls are paced by a rate that rises while calls succeed and halves on 429.
+* XLSX starts a new sheet every 1,048,575 rows. --stream writes XLSX rows as pages arrive with
+  constant memory, in download order. Add --sortmemory to sort on disk first instead.
+* --start/--end limit the export to a response_timestamp range. With --workers, the range is
+  split into windows that are paged at the same time, then merged back in timestamp order.
+  --totalpages applies to each window. Each window is held in memory until it is written, so
+  with --workers memory grows with the window size times --workers, whatever the file type.
+  Raise --windows to keep it down.
+* --statefile records the last cursor and the highest response_timestamp written. If a
+  sequential JSONL or SQLITE export stops early, running the same command again carries on
+  from the last page written. --incremental only pulls logs newer than the last completed export.
+* --summary writes a report of intent counts, confidence histogram, exit reasons, turns per
+  conversation and latency percentiles instead of the logs. It is worked out page by page,
+  so memory stays flat. The report is JSON, or metric,key,value rows with --filetype CSV/TSV.
+* --metrics writes a JSON report of the run: the latency, records and bytes of every page, and
+  the seconds spent fetching, flattening, sorting and writing. --prometheus writes the same
+  totals as a textfile for the Prometheus node exporter. With either, the records per second
+  and an ETA against --totalpages are printed after each page.
+* --dedup drops logs whose log_id was already written in this run, as overlapping filters or
+  windows can return the same log twice. --dedupfile keeps the log_ids in a file, so that later
+  runs also drop logs an earlier run wrote. A Bloom filter in memory with the IDs on disk keeps
+  memory low for tens of millions of IDs.
+* --partitionrecords, --partitionmb and --partitionday split the export into numbered files next
+  to the file name, as in logs-00001.csv or logs-2020-04-01-00001.csv. --partitionmb counts the
+  logs as JSON, which is the JSONL file size. With --compress, each finished file is compressed
+  on background threads while the download carries on. logs.manifest.json lists every file
+  with its row count and request_timestamp range. Partitioned exports are not resumed.
+* The export itself lives in wa_logs/exporter.py, which can be imported to export from python
+  without starting a new process. See export_logs() there.
 * built using python 3.8.
 
 Example command lines:
-* python export_logs.py apikey workspace_id test.json
-* python export_logs.py apikey assistant_id test.xlsx --logtype ASSISTANT --filetype XLSX --url service_url
-* python export_logs.py apikey deployment_id test.csv --logtype DEPLOYMENT --filetype CSV --strip --url service_url
+* python export_logs_py.py apikey workspace_id test.json
+* python export_logs_py.py apikey assistant_id test.xlsx --logtype ASSISTANT --filetype XLSX --url service_url
+* python export_logs_py.py apikey deployment_id test.csv --logtype DEPLOYMENT --filetype CSV --strip --url service_url
+* python export_logs_py.py apikey workspace_id test.jsonl.gz --filetype JSONL --gzip --url service_url
+* python export_logs_py.py apikey workspace_id test.jsonl --filetype JSONL --start 2020-04-01 --end 2020-05-01 --workers 8
+* python export_logs_py.py apikey workspace_id test.parquet --filetype PARQUET
+* python export_logs_py.py apikey workspace_id logs.db --filetype SQLITE --statefile logs.state --incremental
+* python export_logs_py.py apikey workspace_id test.csv --filetype CSV --sortmemory 512
+* python export_logs_py.py apikey workspace_id test.xlsx --filetype XLSX --sortmemory 512
+* python export_logs_py.py apikey workspace_id test.csv --filetype CSV --context REF --contextfile contexts.jsonl
+* python export_logs_py.py apikey workspace_id test.csv --filetype CSV --columns columns.json
+* python export_logs_py.py apikey workspace_id nightly.jsonl --filetype JSONL --statefile nightly.state --incremental
+* python export_logs_py.py apikey workspace_id summary.json --summary --start 2020-04-01 --workers 8
+* python export_logs_py.py apikey workspace_id test.csv --filetype CSV --metrics run.json --prometheus wa_logs.prom
+* python export_logs_py.py apikey workspace_id catchup.jsonl --filetype JSONL --start 2020-04-01 --dedupfile seen.db
+* python export_logs_py.py apikey workspace_id logs.csv --filetype CSV --start 2020-01-01 --partitionday --compress GZIP
 
 """
 
 
-import pandas as pd
 import argparse
-import json
-from ibm_watson import AssistantV1 as WatsonAssistant
-from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
-from urllib.parse import urlparse, parse_qs
-
-C_DEPLOYMENT = 'DEPLOYMENT'
-C_ASSISTANT = 'ASSISTANT'
-C_WORKSPACE = 'WORKSPACE'
-C_CSV = 'CSV'
-C_TSV = 'TSV'
-C_XLSX = 'XLSX'
-C_JSON = 'JSON'
-
-c_RESPONSE = 'response'
-c_CONTEXT = 'context'
-c_SYSTEM = 'system'
-c_INPUT = 'input'
-c_OUTPUT = 'output'
-c_INTENTS = 'intents'
-c_INTENT = 'intent'
-c_TEXT = 'text'
-c_BRANCH_EXITED_REASON = 'branch_exited_reason'
-c_LOG_MESSAGING = 'log_messaging'
-c_CONFIDENCE = 'confidence'
-c_LOGS = 'logs'
-c_PAGINATION = 'pagination'
-c_NEXT_URL = 'next_url'
-c_CURSOR = 'cursor'
+import logging
+import sys
+from datetime import datetime, timezone
+from wa_logs.contexts import ContextDiff, ContextSidecar
+from wa_logs.dedup import LogIdSet
+from wa_logs.exporter import (C_ASSISTANT, C_CSV, C_DEPLOYMENT, C_JSON, C_JSONL, C_PARQUET, C_SQLITE, C_TSV,
+                              C_WORKSPACE, C_XLSX, C_FULL, C_REF, C_DIFF, c_COUNT, c_CURSOR, c_FILENAME, c_FILTER,
+                              c_SINCE, c_TRUNCATED, connect, export, file_types, load_state, log_filter, log_pages, open_writer,
+                              projection_file_types, read_windows, resumable_file_types, since_filter,
+                              split_time_windows, summary_file_types, window_pages)
+from wa_logs.metrics import ExportMetrics
+from wa_logs.partition import C_ZSTD, compressions
+from wa_logs.projection import load_projection
+from wa_logs.flatten import format_timestamp, parse_timestamp
+from wa_logs.retry import RateLimiter, default_retries
 
 # If you want to hard code your main defaults.
 default_version = '2020-04-01'
@@ -78,179 +125,273 @@ default_url = 'https://gateway.watsonplatform.net/assistant/api'
 default_logtype = C_WORKSPACE
 default_language = 'en'
 
-parser = argparse.ArgumentParser()
-parser.add_argument('apikey', help='Watson Assistant API Key.', type=str)
-parser.add_argument('id', help=f'identifier for logtype. For example workspace_id if {C_WORKSPACE} was specified.', type=str)
-parser.add_argument('filename', help='Output file name.',type=str)
-parser.add_argument('--logtype', help=f'What logs to pull. Options are Default is {default_logtype}.',
-                    type=str, default=default_logtype, choices=[C_ASSISTANT, C_WORKSPACE, C_DEPLOYMENT])
-parser.add_argument('--language', help=f'Default is {default_language}.', type=str, default=default_language)
-parser.add_argument('--filetype', help=f'Output file type. Can be: {C_CSV}, {C_TSV}, {C_XLSX}, {C_JSON} (default)',
-                    type=str, default='JSON', choices=[C_CSV, C_TSV, C_XLSX, C_JSON])
-parser.add_argument('--url', help=f'Default is {default_url}.', type=str, default=default_url)
-parser.add_argument('--version', help=f'Default is {default_version}.', type=str, default=default_version)
-parser.add_argument('--totalpages', help='Maximum number of pages to pull. Default is 999', type=int, default=999)
-parser.add_argument('--pagelimit', help='Maximum number of records to a page. Default is 200.', type=int, default=200)
-parser.add_argument('--filter', help='Search filter to use. This overrides logtype, so you will need to manually set.',
-                    type=str, default=None)
-parser.add_argument('--strip', help='Strip newlines from output text. Default is false.', type=bool, default=False)
-
-args = parser.parse_args()
-
-f_conversation_id = 'conversation_id'
-f_request_timestamp = 'request_timestamp'
-f_response_timestamp = 'response_timestamp'
-f_user_input = 'User Input'
-f_output = 'Output'
-f_intent = 'Intent'
-f_confidence = 'Confidence'
-f_exit_reason = 'Exit Reason'
-f_logging = 'Logging'
-f_context = 'Context'
-
-columns = [
-    f_conversation_id, f_request_timestamp, f_response_timestamp, 
-    f_user_input, f_output, f_intent, f_confidence, f_exit_reason, f_logging, f_context
-]
-
-
-# Saving methods.
-def save_json(data=None,file_name=None):
-    with open(file_name, 'w') as out:
-        json.dump(data,out)
-
-
-def save_xsv(data=None, sep=',', file_name=None):
-    df = convert_json_to_dataframe(data)
-    if df is not None:
-        df.to_csv(args.filename,encoding='utf8',sep=sep,index=False)
-
-
-def save_xlsx(data=None, file_name=None):
-    df = convert_json_to_dataframe(data)
-    if df is not None:
-        df.to_excel(args.filename,index=False)
-
-
-def convert_json_to_dataframe(data=None):
-    rows = []
-
-    if data == [[]]:
-        print('No Logs found. :(')
-        return None
-
-    for data_records in data:
-        for o in data_records:
-            row = {}
-            
-            # Let's shorthand the response and system object.
-            r = o[c_RESPONSE]
-            s = r[c_CONTEXT][c_SYSTEM]
-                
-            row[f_conversation_id] = r[c_CONTEXT][f_conversation_id]
-            row[f_request_timestamp] = o[f_request_timestamp]
-            row[f_response_timestamp] = o[f_response_timestamp]
-            
-            if c_TEXT in r[c_INPUT]:
-                row[f_user_input] = r[c_INPUT][c_TEXT]
-
-            if c_TEXT in r[c_OUTPUT]:
-                row[f_output] = ' '.join(r[c_OUTPUT][c_TEXT])
-                if args.strip:
-                    row[f_output] = row[f_output].replace('\l','').replace('\n','').replace('\r','')
-                
-            if len(r[c_INTENTS]) > 0:
-                row[f_confidence] = r[c_INTENTS][0][c_CONFIDENCE]
-                row[f_intent] = r[c_INTENTS][0][c_INTENT]
-
-            if c_BRANCH_EXITED_REASON in s:
-                row[f_exit_reason] = s[c_BRANCH_EXITED_REASON]
-            
-            if c_LOG_MESSAGING in r[c_OUTPUT]:
-                row[f_logging] = r[c_OUTPUT][c_LOG_MESSAGING]
-            
-            row[f_context] = json.dumps(r[c_CONTEXT])
-            
-            rows.append(row)
-
-    # Build the dataframe. 
-    df = pd.DataFrame(rows,columns=columns)
-
-    # cleaning up dataframe. Removing NaN and converting date fields. 
-    df = df.fillna('')
-
-    # Prevent timezone limitation in to_excel call.
-    if args.filetype != C_XLSX:
-        df[f_request_timestamp] = pd.to_datetime(df[f_request_timestamp])
-        df[f_response_timestamp] = pd.to_datetime(df[f_response_timestamp])
-
-    # Lastly sort by conversation ID, and then request, so that the logs become readable. 
-    df = df.sort_values([f_conversation_id, f_request_timestamp], ascending=[True, True])
-
-    return df
-
-
-# Make connection to Watson Assistant.
-authenticator = IAMAuthenticator(args.apikey)
-c = WatsonAssistant(version=args.version, authenticator=authenticator)
-c.set_service_url(args.url)
-
-# Determine how logs will be pulled.
-logtype = None
-pull_filter = None
-
-if args.filter is None:
-    args.logtype = args.logtype.upper()
-    if args.logtype == C_WORKSPACE:
-        logtype = 'workspace_id'
-    elif args.logtype == C_ASSISTANT:
-        logtype = 'request.context.system.assistant_id'
-    elif args.logtype == C_DEPLOYMENT:
-        logtype = 'request.context.metadata.deployment'
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('apikey', help='Watson Assistant API Key.', type=str)
+    parser.add_argument('id', help=f'identifier for logtype. For example workspace_id if {C_WORKSPACE} was specified.', type=str)
+    parser.add_argument('filename', help='Output file name.',type=str)
+    parser.add_argument('--logtype', help=f'What logs to pull. Options are Default is {default_logtype}.',
+                        type=str, default=default_logtype, choices=[C_ASSISTANT, C_WORKSPACE, C_DEPLOYMENT])
+    parser.add_argument('--language', help=f'Default is {default_language}.', type=str, default=default_language)
+    parser.add_argument('--filetype', help=f'Output file type. Can be: {C_CSV}, {C_TSV}, {C_XLSX}, {C_JSONL}, {C_PARQUET}, '
+                        f'{C_SQLITE}, {C_JSON} (default)', type=str, default='JSON', choices=file_types)
+    parser.add_argument('--url', help=f'Default is {default_url}.', type=str, default=default_url)
+    parser.add_argument('--iamurl', help='IAM token service URL. Default is the IBM Cloud one.', type=str, default=None)
+    parser.add_argument('--version', help=f'Default is {default_version}.', type=str, default=default_version)
+    parser.add_argument('--totalpages', help='Maximum number of pages to pull. Default is 999', type=int, default=999)
+    parser.add_argument('--pagelimit', help='Maximum number of records to a page. Default is 200.', type=int, default=200)
+    parser.add_argument('--filter', help='Search filter to use. This overrides logtype, so you will need to manually set.',
+                        type=str, default=None)
+    parser.add_argument('--strip', help='Strip newlines from output text. Default is false.', type=bool, default=False)
+    parser.add_argument('--nocontext', help='Leave the Context column empty instead of serializing every context. '
+                        'Default is false.', action='store_true')
+    parser.add_argument('--context', help=f'How to write the Context column. {C_REF} keeps contexts in a sidecar file '
+                        f'and {C_DIFF} writes the changes from the previous turn. Default is {C_FULL}.',
+                        type=str, default=C_FULL, choices=[C_FULL, C_REF, C_DIFF])
+    parser.add_argument('--contextfile', help=f'Sidecar file for --context {C_REF}. Default is the output file name '
+                        'followed by .contexts.jsonl.', type=str, default=None)
+    parser.add_argument('--columns', help=f'JSON file listing the columns to export, as dotted paths into each log. '
+                        f'Works with {C_CSV}, {C_TSV}, {C_XLSX} and {C_JSONL}.', type=str, default=None)
+    parser.add_argument('--stream', help=f'Write {C_XLSX} rows as pages arrive, unsorted, with constant memory.',
+                        action='store_true')
+    parser.add_argument('--sortmemory', help=f'Sort {C_CSV}/{C_TSV}/{C_XLSX} output on disk using about this many MB of memory. '
+                        'Default is to sort in memory.', type=int, default=None)
+    parser.add_argument('--tempdir', help='Folder for the temporary files used by --sortmemory. Default is the system one.',
+                        type=str, default=None)
+    parser.add_argument('--start', help='Only export logs with a response_timestamp at or after this ISO 8601 time (UTC).',
+                        type=str, default=None)
+    parser.add_argument('--end', help='Only export logs with a response_timestamp before this ISO 8601 time (UTC). '
+                        'Default is now.', type=str, default=None)
+    parser.add_argument('--workers', help='Number of time windows to download at the same time. Requires --start. '
+                        'Each is held in memory until written. Default is 1.', type=int, default=1)
+    parser.add_argument('--windows', help='Number of time windows to split --start/--end into. Default is 4 per worker.',
+                        type=int, default=None)
+    parser.add_argument('--retries', help=f'Times to retry a throttled or failed page. Default is {default_retries}.',
+                        type=int, default=default_retries)
+    parser.add_argument('--rate', help='Pages per second to start at. This goes up while requests succeed and halves '
+                        'when throttled. Default is 5.', type=float, default=5.0)
+    parser.add_argument('--maxrate', help='Never request more than this many pages per second. Default is no limit.',
+                        type=float, default=None)
+    parser.add_argument('--statefile', help='File to keep the export cursor and high water mark in, so runs can be resumed.',
+                        type=str, default=None)
+    parser.add_argument('--incremental', help='Only pull logs newer than the last completed export in --statefile.',
+                        action='store_true')
+    parser.add_argument('--summary', help=f'Write a summary report of the logs instead of the logs, as {C_JSON} or '
+                        f'{C_CSV}/{C_TSV}.', action='store_true')
+    parser.add_argument('--gzip', help=f'Gzip the output while streaming. Only used with {C_JSONL}. Default is false.',
+                        action='store_true')
+    parser.add_argument('--dedup', help='Drop logs with a log_id that was already written in this run.',
+                        action='store_true')
+    parser.add_argument('--dedupfile', help='Keep the log_ids written in this file, and drop logs with a log_id from '
+                        'it. Implies --dedup.', type=str, default=None)
+    parser.add_argument('--partitionrecords', help='Start a new output file after this many records.', type=int,
+                        default=None)
+    parser.add_argument('--partitionmb', help='Keep each output file under this many MB of logs, measured as JSON.',
+                        type=float, default=None)
+    parser.add_argument('--partitionday', help='Write each day of request_timestamp to its own output files.',
+                        action='store_true')
+    parser.add_argument('--compress', help='Compress each finished partition in the background.', type=str,
+                        default=None, choices=compressions)
+    parser.add_argument('--compressworkers', help='Number of partitions to compress at the same time. Default is 2.',
+                        type=int, default=2)
+    parser.add_argument('--metrics', help='Write page latencies and the time spent in each stage to this JSON file.',
+                        type=str, default=None)
+    parser.add_argument('--prometheus', help='Write the run metrics to this Prometheus textfile, for the node exporter.',
+                        type=str, default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    # Make connection to Watson Assistant. All workers share the client.
+    c = connect(apikey=args.apikey, url=args.url, version=args.version, iam_url=args.iamurl,
+                pool_size=max(args.workers, 10))
+    limiter = RateLimiter(rate=args.rate, max_rate=args.maxrate)
+
+    # Determine how logs will be pulled.
+    if args.filter is None:
+        args.logtype = args.logtype.upper()
+        try:
+            pull_filter = log_filter(log_type=args.logtype, id=args.id, language=args.language)
+        except ValueError as error:
+            print(f'Error: {error} Exiting.')
+            exit(1)
+
+        print(f'Reading {args.logtype} using ID {args.id}.')
     else:
-        print("Error: I don't understand logtype {}. Exiting.".format(args.logtype))
+        print(f'Reading using filter: {args.filter}')
+        pull_filter = args.filter
+
+    args.filetype = args.filetype.upper()
+
+    if args.summary and args.filetype not in summary_file_types:
+        print(f'Error: --summary is written as {C_JSON}, {C_CSV} or {C_TSV}. Exiting.')
+        exit(1)
+
+    # Pick the columns to export.
+    projection = None
+    if args.columns is not None:
+        if args.summary or args.filetype not in projection_file_types or args.context != C_FULL:
+            print(f'Error: --columns applies to {C_CSV}, {C_TSV}, {C_XLSX} and {C_JSONL}, without --summary or '
+                  '--context. Exiting.')
+            exit(1)
+
+        try:
+            projection = load_projection(args.columns)
+        except (OSError, ValueError) as error:
+            print(f'Error: --columns {error} Exiting.')
+            exit(1)
+
+        print('Exporting columns: {}'.format(', '.join(projection.names)))
+
+    # Contexts only have a column in the tabular file types.
+    context = not args.nocontext
+    if args.context != C_FULL and not args.nocontext:
+        if args.summary or args.filetype not in [C_CSV, C_TSV, C_XLSX, C_PARQUET]:
+            print(f'Error: --context {args.context} only applies to {C_CSV}, {C_TSV}, {C_XLSX} and {C_PARQUET}. Exiting.')
+            exit(1)
+
+        if args.context == C_REF:
+            context = ContextSidecar(file_name=args.contextfile or args.filename + '.contexts.jsonl')
+            print(f'Writing contexts to: {context.file_name}')
+        else:
+            context = ContextDiff()
+
+    # Split the output into many files.
+    partition = None
+    if args.partitionrecords is not None or args.partitionmb is not None or args.partitionday:
+        if args.summary or args.gzip:
+            print('Error: --partitionrecords, --partitionmb and --partitionday cannot be used with --summary or --gzip. '
+                  'Use --compress instead of --gzip. Exiting.')
+            exit(1)
+
+        if ((args.partitionrecords is not None and args.partitionrecords < 1)
+                or (args.partitionmb is not None and args.partitionmb <= 0) or args.compressworkers < 1):
+            print('Error: --partitionrecords, --partitionmb and --compressworkers must be more than 0. Exiting.')
+            exit(1)
+
+        partition = dict(max_records=args.partitionrecords, by_day=args.partitionday, compression=args.compress,
+                         workers=args.compressworkers,
+                         max_bytes=max(1, int(args.partitionmb * 1024 * 1024)) if args.partitionmb is not None else None)
+    elif args.compress is not None:
+        print('Error: --compress needs --partitionrecords, --partitionmb or --partitionday. Exiting.')
+        exit(1)
+
+    # Pick up where the last run left off.
+    state = load_state(args.statefile)
+
+    if args.incremental:
+        if args.statefile is None:
+            print('Error: --incremental needs a --statefile. Exiting.')
+            exit(1)
+
+        if state.get(c_SINCE):
+            print(f'Reading logs newer than {state[c_SINCE]}.')
+            pull_filter = since_filter(pull_filter, state[c_SINCE])
+
+    # Work out the time windows, if any.
+    windows = None
+    if args.start is not None:
+        start = parse_timestamp(args.start)
+        end = parse_timestamp(args.end) if args.end is not None else datetime.now(timezone.utc)
+        if args.windows is None:
+            args.windows = args.workers * 4 if args.workers > 1 else 1
+        windows = split_time_windows(start=start, end=end, count=args.windows)
+        print(f'Reading {format_timestamp(start)} to {format_timestamp(end)} in {len(windows)} window(s).')
+    elif args.workers > 1:
+        print('Error: --workers needs --start to split the export into time windows. Exiting.')
         exit(1)
 
-    print(f'Reading {args.logtype} using ID {args.id}.')
-    pull_filter = 'language::{},{}::{}'.format(args.language, logtype, args.id)
-else:
-    print(f'Reading using filter: {args.filter}')
-    pull_filter = args.filter
-
-# Download the logs.
-j = []
-page_count = 1
-cursor = None
-count = 0
-
-x = { c_PAGINATION: 'DUMMY' }
-while x[c_PAGINATION]:
-    if page_count > args.totalpages: 
-        break
-
-    print('Reading page {}.'.format(page_count))
-    x = c.list_all_logs(filter=pull_filter,cursor=cursor,page_limit=args.pagelimit).result
-    
-    j.append(x[c_LOGS])
-    count = count + len(x[c_LOGS])
-
-    page_count = page_count + 1
-
-    if c_PAGINATION in x and c_NEXT_URL in x[c_PAGINATION]:
-        p = x[c_PAGINATION][c_NEXT_URL]
-        u = urlparse(p)
-        query = parse_qs(u.query)
-        cursor = query[c_CURSOR][0]
-    
-# Determine how the file should be saved.
-args.filetype = args.filetype.upper()
-if args.filetype == C_CSV:
-    save_xsv(data=j, sep=',',file_name=args.filename)
-elif args.filetype == C_TSV:
-    save_xsv(data=j, sep='\t',file_name=args.filename)
-elif args.filetype == C_XLSX:
-    save_xlsx(data=j, file_name=args.filename)
-else:
-    save_json(data=j, file_name=args.filename),
- 
-print('Writing {} records to: {} as file type: {}'.format(count, args.filename, args.filetype))
+    # A cursor only belongs to the filter that produced it, and only JSONL and SQLITE can be added to.
+    cursor = None
+    count = 0
+    if state.get(c_CURSOR) and state.get(c_FILTER) == pull_filter and state.get(c_FILENAME) == args.filename:
+        if args.filetype in resumable_file_types and windows is None and not args.summary and partition is None:
+            cursor = state[c_CURSOR]
+            count = state.get(c_COUNT, 0)
+            print(f'Resuming after {count} records.')
+        else:
+            print(f'Only sequential, unpartitioned {C_JSONL} and {C_SQLITE} exports can be resumed. '
+                  'Starting from page 1.')
+
+    state[c_FILTER] = pull_filter
+    state[c_FILENAME] = args.filename
+    state[c_CURSOR] = cursor
+    state[c_TRUNCATED] = []
+
+    # JSONL, PARQUET, streamed XLSX and summaries are written page by page as they download. With
+    # --sortmemory, CSV/TSV/XLSX are sorted by conversation ID, and then request, on disk.
+    try:
+        writer = open_writer(file_type=args.filetype, file_name=args.filename, strip=args.strip,
+                             context=context, stream=args.stream,
+                             sort_memory=args.sortmemory * 1024 * 1024 if args.sortmemory is not None else None,
+                             temp_dir=args.tempdir, compress=args.gzip, append=cursor is not None,
+                             summary=args.summary, projection=projection, partition=partition)
+    except ImportError as error:
+        if args.compress == C_ZSTD and error.name == 'zstandard':
+            print(f'Error: {C_ZSTD} compression needs zstandard. Run "pip install zstandard". Exiting.')
+        else:
+            print(f'Error: {args.filetype} output needs {error.name}. Run "pip install {error.name}". Exiting.')
+        exit(1)
+
+    # Time the run if asked to. The ETA assumes every page is full.
+    metrics = None
+    if args.metrics is not None or args.prometheus is not None:
+        metrics = ExportMetrics(expected=args.totalpages * args.pagelimit * len(windows or [None]))
+
+    options = dict(page_limit=args.pagelimit, total_pages=args.totalpages, limiter=limiter, retries=args.retries,
+                   metrics=metrics)
+    if windows is None:
+        pages = log_pages(client=c, pull_filter=pull_filter, cursor=cursor, progress=state, **options)
+    elif args.workers > 1:
+        pages = read_windows(client=c, pull_filter=pull_filter, windows=windows, workers=args.workers, progress=state,
+                             **options)
+    else:
+        pages = (page for window in windows
+                 for page in window_pages(client=c, pull_filter=pull_filter, window=window, progress=state, **options))
+
+    # Download the logs and save them. Once everything is written, the high water mark
+    # becomes the starting point for --incremental.
+    dedup = None
+    if args.dedup or args.dedupfile is not None:
+        dedup = LogIdSet(file_name=args.dedupfile)
+        if args.dedupfile is not None:
+            print(f'Dropping logs already in {args.dedupfile} ({dedup.count} log_ids).')
+
+    success = False
+    try:
+        count = export(pages=pages, writer=writer, count=count, state=state, state_file=args.statefile,
+                       metrics=metrics, dedup=dedup)
+        success = True
+    finally:
+        if callable(context):
+            context.close()
+        if dedup is not None:
+            dedup.close(save=success)
+        if metrics is not None:
+            metrics.finish(success)
+            metrics.save(file_name=args.metrics, prometheus_file=args.prometheus,
+                         labels={'filename': args.filename})
+
+    if dedup is not None:
+        print(f'Dropped {dedup.dropped} duplicate logs.')
+
+    if args.summary:
+        print('Writing a summary of {} records to: {} as file type: {}'.format(count, args.filename, args.filetype))
+    else:
+        print('Writing {} records to: {} as file type: {}'.format(count, args.filename, args.filetype))
+
+    if state[c_TRUNCATED]:
+        print('Warning: --totalpages ran out before the end of the windows starting {}. Raise --totalpages to '
+              'export the rest.'.format(', '.join(sorted(state[c_TRUNCATED]))))
+        if args.incremental:
+            print('The --incremental starting point was left at {}, so the next run pulls them.'.format(
+                state.get(c_SINCE) or 'the beginning'))
+
+
+if __name__ == '__main__':
+    # The wa_logs modules report progress through logging.
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stdout)
+    main()
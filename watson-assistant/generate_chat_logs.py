@@ -9,8 +9,17 @@ import datetime
 import re
 import csv
 import argparse
+import threading
+import time
+import itertools
+import hashlib
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from watson_developer_cloud import ConversationV1, WatsonApiException
 
+CACHE_RECORD = 'RECORD'
+CACHE_REPLAY = 'REPLAY'
+
 
 def build_metadata(arguments):
     """
@@ -46,9 +55,348 @@ def parse_arguments():
     parser.add_argument("--customer_id")
     parser.add_argument("--deployment_id")
     parser.add_argument("--user_id")
+    parser.add_argument("--concurrency", help="Number of conversations to run at the same time. Default is 1.",
+                        type=int, default=1)
+    parser.add_argument("--load", help="Load test: loop over the conversations for --duration seconds and report latencies.",
+                        action="store_true")
+    parser.add_argument("--duration", help="Seconds to run a load test for. Default is 60.", type=float, default=60)
+    parser.add_argument("--rps", help="Target /message requests per second in a load test. Default is as fast as "
+                        "--concurrency allows.", type=float, default=None)
+    parser.add_argument("--rampup", help="Seconds to ramp up conversations (and --rps) to full load. Default is 0.",
+                        type=float, default=0)
+    parser.add_argument("--report", help="Also write the load test report to this JSON file.")
+    parser.add_argument("--cache", help="SQLite file to record responses in, and replay them from.")
+    parser.add_argument("--cachemode", help="RECORD always calls the service and stores the responses. REPLAY answers "
+                        "turns recorded against the same workspace version from the cache. Default is REPLAY.",
+                        choices=[CACHE_RECORD, CACHE_REPLAY], default=CACHE_REPLAY)
+    parser.add_argument("--cachesize", help="Evict the least recently used responses once the cache holds more than "
+                        "this many MB. Default is 100.", type=float, default=100)
+    parser.add_argument("--cacheversion", help="Workspace version to key the cache on. Default is the time the "
+                        "workspace was last updated.")
     return parser.parse_args()
 
 
+def message_result(response):
+    """
+    Newer versions of the SDK wrap the /message result in a DetailedResponse.
+    """
+    return response.get_result() if hasattr(response, 'get_result') else response
+
+
+def read_conversations(question_csv_file):
+    """
+    Splits the CSV file into conversations, each a list of utterances in the order they are sent.
+    Lines starting with ; are skipped and :init: starts a new conversation.
+    """
+    conversations = [[]]
+    with open(question_csv_file) as csv_file:
+        for turn in csv.DictReader(csv_file, escapechar='\\'):
+            question = turn['question']
+            if question[:1] == ';':
+                continue
+            if question == ':init:':
+                conversations.append([])
+                continue
+            conversations[-1].append(question)
+
+    return [conversation for conversation in conversations if conversation]
+
+
+def output_text(response):
+    return ' '.join(str(x) for x in response['output']['text'])
+
+
+class ResponseCache(object):
+    """
+    Persists /message responses in SQLite so an unchanged workspace can be replayed without the service.
+
+    A turn is looked up by its utterance and its input context, less the conversation_id, which is
+    new in every run. A replayed response carries the conversation_id of the conversation it is
+    replayed into, or none until the service has handed one out. Each entry keeps the workspace
+    version it was recorded against, and is only replayed for that version. Other turns are sent to the service; if one was recorded against
+    an earlier version and the output text has changed, it is reported. Once the cache is over
+    max_bytes, the least recently used responses are dropped.
+    """
+
+    def __init__(self, file_name, version, mode=CACHE_REPLAY, max_bytes=100 * 1024 * 1024):
+        self.version = version
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.calls = 0
+        self.changes = []
+        self.db = sqlite3.connect(file_name, check_same_thread=False)
+        self.db.execute('create table if not exists responses (key text primary key, version text, question text, '
+                        'response text, size integer, used real)')
+        self.db.execute('create index if not exists responses_used on responses (used)')
+        self.size = self.db.execute('select coalesce(sum(size), 0) from responses').fetchone()[0]
+
+    def key(self, question, context):
+        context = dict((k, v) for k, v in (context or {}).items() if k != 'conversation_id')
+        text = json.dumps([question, context], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(text.encode('utf8')).hexdigest()
+
+    def message(self, conversation, workspace_id, question, context):
+        key = self.key(question, context)
+        with self.lock:
+            row = self.db.execute('select version, response from responses where key = ?', (key,)).fetchone()
+            if row is not None and row[0] == self.version and self.mode == CACHE_REPLAY:
+                self.db.execute('update responses set used = ? where key = ?', (time.time(), key))
+                self.hits += 1
+                response = json.loads(row[1])
+                # The recorded ID belongs to another conversation, and later live turns would join it.
+                live_id = (context or {}).get('conversation_id')
+                if live_id is None:
+                    response['context'].pop('conversation_id', None)
+                else:
+                    response['context']['conversation_id'] = live_id
+                return response
+
+        response = message_result(conversation.message(workspace_id=workspace_id, input={'text': question}, context=context))
+
+        text = json.dumps(response)
+        with self.lock:
+            self.calls += 1
+            if row is not None:
+                recorded = json.loads(row[1])
+                if output_text(recorded) != output_text(response):
+                    self.changes.append({'question': question, 'recorded_version': row[0],
+                                         'recorded': output_text(recorded), 'live': output_text(response)})
+            # Another thread may have stored or evicted this key during the call, so size what is there now.
+            current = self.db.execute('select size from responses where key = ?', (key,)).fetchone()
+            if current is not None:
+                self.size -= current[0]
+            self.db.execute('insert or replace into responses values (?, ?, ?, ?, ?, ?)',
+                            (key, self.version, question, text, len(text), time.time()))
+            self.size += len(text)
+            self.db.commit()
+            if self.size > self.max_bytes:
+                self.evict()
+        return response
+
+    def evict(self):
+        # Go a little under the limit, so the next few inserts do not each evict again.
+        target = self.max_bytes * 0.9
+        doomed = []
+        for key, size in self.db.execute('select key, size from responses order by used'):
+            if self.size <= target:
+                break
+            doomed.append((key,))
+            self.size -= size
+        self.db.executemany('delete from responses where key = ?', doomed)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def send_message(conversation, workspace_id, question, context, cache=None):
+    if cache is not None:
+        return cache.message(conversation, workspace_id, question, context)
+    return message_result(conversation.message(workspace_id=workspace_id, input={'text': question}, context=context))
+
+
+def workspace_version(conversation, workspace_id):
+    """
+    The time the workspace was last updated, which changes whenever it is edited.
+    """
+    workspace = message_result(conversation.get_workspace(workspace_id=workspace_id))
+    return workspace['updated']
+
+
+def run_conversation(conversation, workspace_id, utterances, metadata, cache=None):
+    """
+    Sends the utterances of one conversation in order, threading the context from turn to turn.
+    Returns the lines to print, and the error that stopped the conversation if there was one.
+    """
+    context = {'metadata': metadata} if metadata is not None else None
+    lines = []
+
+    for question in utterances:
+        try:
+            response = send_message(conversation, workspace_id, question, context, cache)
+        except WatsonApiException as error:
+            lines.append(str(error))
+            return lines, error
+
+        # Replayed turns have no ID until the first one sent to the service.
+        if 'conversation_id' in response['context'] and (context is None or 'conversation_id' not in context):
+            lines.append('Conversation ID: %s (%s)' % (response['context']['conversation_id'], str(datetime.datetime.now())))
+
+        context = response['context']
+        output = output_text(response)
+
+        lines.append('Input : %s' % question)
+        lines.append('Output: %s\n' % output)
+
+    return lines, None
+
+
+# Upper bounds, in milliseconds, of the latency histogram buckets in the load test report.
+LATENCY_BUCKETS_MS = [25, 50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000]
+
+
+class Pacer(object):
+    """
+    Spaces requests out to a target rate, shared by all load test threads.
+    The rate climbs linearly from one request per second, or rps if that is lower, to rps over rampup seconds.
+    """
+
+    def __init__(self, rps, rampup, started):
+        self.rps = rps
+        self.rampup = rampup
+        self.started = started
+        self.next_slot = started
+        self.lock = threading.Lock()
+
+    def rate(self, now):
+        if self.rampup <= 0 or now - self.started >= self.rampup:
+            return self.rps
+        return min(self.rps, max(1.0, self.rps * (now - self.started) / self.rampup))
+
+    def wait(self, deadline):
+        """
+        Sleeps until the next request may be sent. Returns False if that is past the deadline.
+        """
+        with self.lock:
+            now = time.time()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + 1.0 / self.rate(slot)
+
+        if slot >= deadline:
+            return False
+        time.sleep(slot - now)
+        return True
+
+
+def percentiles(latencies):
+    """
+    Summarises a list of latencies in seconds as milliseconds.
+    """
+    if not latencies:
+        return {'count': 0}
+
+    ordered = sorted(latencies)
+
+    def rank(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 1)
+
+    return {'count': len(ordered), 'mean': round(sum(ordered) / len(ordered) * 1000, 1),
+            'p50': rank(0.50), 'p95': rank(0.95), 'p99': rank(0.99), 'max': round(ordered[-1] * 1000, 1)}
+
+
+class LoadStats(object):
+    """
+    Collects per-turn latencies and errors from all load test threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.conversations = 0
+
+    def record(self, turn_number, latency):
+        with self.lock:
+            self.latencies.setdefault(turn_number, []).append(latency)
+
+    def error(self, kind):
+        with self.lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def finished_conversation(self):
+        with self.lock:
+            self.conversations += 1
+
+    def report(self, elapsed, args):
+        all_latencies = [latency for latencies in self.latencies.values() for latency in latencies]
+        histogram = []
+        for bucket in LATENCY_BUCKETS_MS + [None]:
+            upper = float('inf') if bucket is None else bucket / 1000.0
+            histogram.append({'le_ms': '+Inf' if bucket is None else bucket,
+                              'count': sum(1 for latency in all_latencies if latency <= upper)})
+
+        return {
+            'duration_seconds': round(elapsed, 3),
+            'concurrency': args.concurrency,
+            'target_rps': args.rps,
+            'rampup_seconds': args.rampup,
+            'conversations': self.conversations,
+            'turns': len(all_latencies),
+            'errors': sum(self.errors.values()),
+            'errors_by_type': self.errors,
+            'throughput_rps': round(len(all_latencies) / elapsed, 2) if elapsed > 0 else 0,
+            'latency_ms': percentiles(all_latencies),
+            'latency_by_turn_ms': dict((str(turn), percentiles(self.latencies[turn])) for turn in sorted(self.latencies)),
+            'histogram_ms': histogram
+        }
+
+
+def run_load(conversation, workspace_id, conversations, metadata, args):
+    """
+    Loops over the conversations on --concurrency threads for --duration seconds.
+    Threads start spread over --rampup seconds. Returns the load test report.
+    """
+    stats = LoadStats()
+    started = time.time()
+    deadline = started + args.duration
+    pacer = Pacer(args.rps, args.rampup, started) if args.rps else None
+    concurrency = max(args.concurrency, 1)
+
+    cycle_lock = threading.Lock()
+    cycle = itertools.cycle(conversations)
+
+    def worker(index):
+        time.sleep(args.rampup * index / concurrency)
+        while time.time() < deadline:
+            with cycle_lock:
+                utterances = next(cycle)
+
+            context = {'metadata': metadata} if metadata is not None else None
+            for turn_number, question in enumerate(utterances, 1):
+                if pacer is not None and not pacer.wait(deadline):
+                    return
+                if time.time() >= deadline:
+                    return
+
+                sent = time.time()
+                try:
+                    response = message_result(conversation.message(workspace_id=workspace_id, input={'text': question}, context=context))
+                except WatsonApiException as error:
+                    stats.error('HTTP %s' % error.code)
+                    break
+                except Exception as error:
+                    stats.error(type(error).__name__)
+                    break
+
+                stats.record(turn_number, time.time() - sent)
+                context = response['context']
+            else:
+                stats.finished_conversation()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker, index) for index in range(concurrency)]:
+            future.result()
+
+    return stats.report(time.time() - started, args)
+
+
+def print_report(report):
+    """
+    Prints the headline numbers of a load test report.
+    """
+    latency = report['latency_ms']
+    print('Turns: %d in %.1fs (%.2f/s), conversations: %d, errors: %d' % (
+        report['turns'], report['duration_seconds'], report['throughput_rps'], report['conversations'], report['errors']))
+    if latency['count']:
+        print('Latency ms: p50 %s, p95 %s, p99 %s, max %s' % (latency['p50'], latency['p95'], latency['p99'], latency['max']))
+    for turn, turn_latency in report['latency_by_turn_ms'].items():
+        print('  turn %s: %d requests, p50 %s, p95 %s, p99 %s, max %s' % (
+            turn, turn_latency['count'], turn_latency['p50'], turn_latency['p95'], turn_latency['p99'], turn_latency['max']))
+    for kind, count in sorted(report['errors_by_type'].items()):
+        print('  %s: %d' % (kind, count))
+
 
 def main():
     """Given a CSV file containing utterances to simulate a user's questions, and a set of
@@ -66,6 +414,19 @@ def main():
     :init:
     hi
     hit the brake
+
+    With --concurrency, several conversations run at the same time. Turns within a
+    conversation are still sent in order, and each conversation is printed in one
+    piece once it finishes.
+
+    With --load, the conversations are looped over for --duration seconds instead, optionally
+    paced to --rps and ramped up over --rampup seconds. A report of latency percentiles, errors
+    and throughput is printed at the end, and written as JSON to --report if given.
+
+    With --cache, responses are recorded in a file. A later run against the same workspace
+    version replays them instead of calling the service, so an unchanged regression suite runs
+    in seconds. Once the workspace changes, turns are sent live again, and any whose output
+    differs from the recording are listed at the end.
     """
     # 1. Parse the arguments
     args = parse_arguments()
@@ -80,40 +441,66 @@ def main():
     if args.customer_id is not None:
         conversation.set_default_headers({'X-Watson-Metadata': 'customer_id=' + args.customer_id})
 	
-	# 2. Built the message metadata and context if provided
+    # 3. Build the message metadata if provided
     metadata = build_metadata(args)
-    context = {'metadata': metadata} if metadata is not None else None
 
-    # 3. Read the CSV file
-    csv_reader = csv.DictReader(open(args.question_csv_file), escapechar='\\')
-    test_result = True
-    turn_count = 0
-
-    # 4. Process the csv file
-    for turn in csv_reader:
-        turn_count += 1
-        if turn['question'][0] == ';':
-            continue
-        if turn['question'] == ':init:':
-            context = {'metadata': metadata} if metadata is not None else None
-            turn_count = 0
-            continue
+    # 4. Read the CSV file into conversations
+    conversations = read_conversations(args.question_csv_file)
 
-        response = None
-        try:
-            response = conversation.message(workspace_id=args.workspace_id, input={'text': turn["question"]}, context=context)
-        except WatsonApiException as error:
-            print(error)
+    cache = None
+    if args.cache is not None:
+        if args.load:
+            print('Error: --cache would hide the latency that --load measures. Exiting.')
             sys.exit(1)
 
-        context = response['context']
-        output = ' '.join(str(x) for x in response['output']['text'])
+        version = args.cacheversion
+        if version is None:
+            try:
+                version = workspace_version(conversation, args.workspace_id)
+            except WatsonApiException as error:
+                print('Error: could not read the workspace version, set --cacheversion instead. %s Exiting.' % error)
+                sys.exit(1)
+        cache = ResponseCache(args.cache, version, mode=args.cachemode, max_bytes=args.cachesize * 1024 * 1024)
+
+    if args.load:
+        report = run_load(conversation, args.workspace_id, conversations, metadata, args)
+        print_report(report)
+        if args.report is not None:
+            with open(args.report, 'w') as out:
+                json.dump(report, out, indent=2)
+        return
+
+    # 5. Run the conversations, printing each one whole as it finishes
+    print_lock = threading.Lock()
+    errors = []
+
+    def replay(utterances):
+        # Stop starting new conversations once one has failed.
+        if errors:
+            return
+        lines, error = run_conversation(conversation, args.workspace_id, utterances, metadata, cache)
+        with print_lock:
+            print('\n'.join(lines))
+            if error is not None:
+                errors.append(error)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(args.concurrency, 1)) as pool:
+            for future in [pool.submit(replay, utterances) for utterances in conversations]:
+                future.result()
+    finally:
+        if cache is not None:
+            cache.close()
 
-        if turn_count == 1:
-            print('Conversation ID: %s (%s)' % (context['conversation_id'], str(datetime.datetime.now())))
+    if cache is not None:
+        print('Cache: %d turns replayed, %d sent to the service, %d changed.' % (cache.hits, cache.calls, len(cache.changes)))
+        for change in cache.changes:
+            print('Changed: %s' % change['question'])
+            print('  recorded (%s): %s' % (change['recorded_version'], change['recorded']))
+            print('  live: %s' % change['live'])
 
-        print('Input : %s' % turn['question'])
-        print('Output: %s\n' % output)
+    if errors:
+        sys.exit(1)
 
     return
 
@@ -0,0 +1,337 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" A local stand-in for the Watson Assistant v1 API, for benchmarking and testing offline.
+
+Serves the endpoints that export_logs.py, export_logs_py.py and generate_chat_logs.py use:
+* POST /identity/token                  IAM token, so IAMAuthenticator works unchanged.
+* GET  /v1/logs                         list_all_logs, with cursor pagination and next_url.
+* GET  /v1/workspaces/{id}/logs         list_logs, same as above.
+* POST /v1/workspaces/{id}/message      answers from a workspace JSON, e.g. car_demo_workspace.json.
+
+Logs are synthetic (see wa_logs/synthetic.py) unless --logfile gives a JSONL export to serve.
+The response_timestamp clauses of the filter (>=, >, <=, <) are honoured; everything else in
+the filter is accepted and ignored. Latency, throttling (429) and server errors (500) can be injected.
+
+Example command lines:
+* python mock_assistant_server.py --workspace car_demo_workspace.json
+* python mock_assistant_server.py --logs 1000000 --latency 150 --jitter 50 --throttle 0.02 --errors 0.01
+
+Then point the scripts at it:
+* python export_logs_py.py apikey workspace_id test.jsonl --filetype JSONL --url http://localhost:8080 --iamurl http://localhost:8080
+* python export_logs.py workspace_id test.csv --userpass user:pass --filetype CSV --url http://localhost:8080
+* python generate_chat_logs.py user pass workspace_id utterances-for-generate-chat-logs.csv --url http://localhost:8080
+"""
+
+import argparse
+import base64
+import json
+import random
+import re
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+from wa_logs.synthetic import LogSet, workspace_intents
+
+c_RESPONSE_TIMESTAMP = 'response_timestamp'
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--host', help='Default is localhost.', type=str, default='localhost')
+parser.add_argument('--port', help='Default is 8080.', type=int, default=8080)
+parser.add_argument('--workspace', help='Workspace JSON to answer /message from. Default is car_demo_workspace.json.',
+                    type=str, default='car_demo_workspace.json')
+parser.add_argument('--logs', help='Number of synthetic log records to serve. Default is 10000.', type=int, default=10000)
+parser.add_argument('--logfile', help='Serve the records of this JSONL export instead of synthetic ones.',
+                    type=str, default=None)
+parser.add_argument('--contextsize', help='Extra skill variables in each synthetic context. Default is 20.',
+                    type=int, default=20)
+parser.add_argument('--latency', help='Milliseconds added to every API call. Default is 0.', type=float, default=0)
+parser.add_argument('--jitter', help='Random milliseconds, up to this many, added on top of --latency. Default is 0.',
+                    type=float, default=0)
+parser.add_argument('--throttle', help='Fraction of API calls answered with 429. Default is 0.', type=float, default=0)
+parser.add_argument('--retryafter', help='Retry-After seconds sent with a 429. Default is 1.', type=int, default=1)
+parser.add_argument('--errors', help='Fraction of API calls answered with 500. Default is 0.', type=float, default=0)
+parser.add_argument('--verbose', help='Log every request.', action='store_true')
+
+
+class RecordedLogs(list):
+    """ Log records from a JSONL export, ordered by response_timestamp like the synthetic ones. """
+
+    def __init__(self, file_name=None):
+        with open(file_name, encoding='utf8') as f:
+            super().__init__(json.loads(line) for line in f if line.strip())
+        self.sort(key=lambda o: o[c_RESPONSE_TIMESTAMP])
+
+    def response_timestamp(self, index=0):
+        return self[index][c_RESPONSE_TIMESTAMP]
+
+
+class TimestampView:
+    """ The response timestamps of a log set, as a sequence bisect can search. """
+
+    def __init__(self, logs=None):
+        self.logs = logs
+
+    def __len__(self):
+        return len(self.logs)
+
+    def __getitem__(self, index):
+        return self.logs.response_timestamp(index)
+
+
+def filter_range(logs=None, log_filter=''):
+    """ The first and last+1 index of the records matching the response_timestamp clauses of a filter. """
+    view = TimestampView(logs)
+    lo, hi = 0, len(logs)
+    for clause in (log_filter or '').split(','):
+        match = re.match(r'^\s*{}(>=|<=|>|<)(.+?)\s*$'.format(c_RESPONSE_TIMESTAMP), clause)
+        if match is None:
+            continue
+
+        op, value = match.groups()
+        if op == '>=':
+            lo = max(lo, bisect_left(view, value))
+        elif op == '>':
+            lo = max(lo, bisect_right(view, value))
+        elif op == '<':
+            hi = min(hi, bisect_left(view, value))
+        else:
+            hi = min(hi, bisect_right(view, value))
+
+    return lo, max(lo, hi)
+
+
+def tokens(text=''):
+    return set(re.findall(r'[a-z0-9]+', text.lower()))
+
+
+def node_text(node=None):
+    """ The first response text of a dialog node, in any of the workspace output formats. """
+    output = node.get('output') or {}
+    text = output.get('text')
+    if isinstance(text, str) and text:
+        return text
+    if isinstance(text, dict) and text.get('values'):
+        return text['values'][0]
+    for generic in output.get('generic', []):
+        for value in generic.get('values', []):
+            if value.get('text'):
+                return value['text']
+    return None
+
+
+class Workspace:
+    """ Answers /message from a workspace JSON: intents by word overlap, then the first matching root node. """
+
+    def __init__(self, file_name=None):
+        with open(file_name) as f:
+            workspace = json.load(f)
+
+        self.examples = [(intent['intent'], tokens(example['text']))
+                         for intent in workspace.get('intents', []) for example in intent.get('examples', [])]
+
+        nodes = workspace.get('dialog_nodes', [])
+        self.nodes = dict((node['dialog_node'], node) for node in nodes)
+        self.children = {}
+        for node in nodes:
+            self.children.setdefault(node.get('parent'), []).append(node)
+        for parent, siblings in self.children.items():
+            self.children[parent] = self.in_sibling_order(siblings)
+
+    def in_sibling_order(self, siblings=None):
+        after = dict((node.get('previous_sibling'), node) for node in siblings)
+        ordered = []
+        node = after.get(None)
+        while node is not None and len(ordered) < len(siblings):
+            ordered.append(node)
+            node = after.get(node['dialog_node'])
+        return ordered or siblings
+
+    def classify(self, text=''):
+        words = tokens(text)
+        scores = {}
+        for intent, example in self.examples:
+            if words and example:
+                score = len(words & example) / len(words | example)
+                scores[intent] = max(score, scores.get(intent, 0))
+
+        ranked = sorted(scores.items(), key=lambda item: -item[1])
+        return [{'intent': intent, 'confidence': round(min(1.0, 0.3 + score), 6)}
+                for intent, score in ranked[:10] if score > 0]
+
+    def matches(self, condition='', intents=None, welcome=False):
+        condition = (condition or '').strip()
+        if condition in ['anything_else', 'true']:
+            return True
+        if condition in ['welcome', 'conversation_start']:
+            return welcome
+        top = intents[0]['intent'] if intents else None
+        return top is not None and '#' + top in re.findall(r'#[\w-]+', condition)
+
+    def answer(self, node=None, visited=None):
+        """ Text for a node, following jumps and then children depth first when it has none of its own. """
+        if node is None or node['dialog_node'] in visited:
+            return None
+        visited.append(node['dialog_node'])
+
+        text = node_text(node)
+        if text is not None:
+            return text
+
+        go_to = (node.get('go_to') or {}).get('dialog_node')
+        if go_to is not None:
+            return self.answer(self.nodes.get(go_to), visited)
+
+        for child in self.children.get(node['dialog_node'], []):
+            text = self.answer(child, visited)
+            if text is not None:
+                return text
+        return None
+
+    def respond(self, text='', first_turn=False):
+        intents = self.classify(text)
+        for node in self.children.get(None, []):
+            if self.matches(node.get('conditions'), intents, welcome=first_turn and not text):
+                visited = []
+                answer = self.answer(node, visited)
+                return intents, [answer] if answer is not None else [], visited
+
+        return intents, [], []
+
+
+def mock_token():
+    # IAMAuthenticator only decodes the token to read when it expires.
+    def encode(part):
+        return base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip('=')
+
+    now = int(time.time())
+    return '{}.{}.{}'.format(encode({'alg': 'RS256', 'typ': 'JWT'}), encode({'iat': now, 'exp': now + 3600}),
+                             base64.urlsafe_b64encode(b'mock').decode().rstrip('='))
+
+
+class AssistantHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.args.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, body=None, code=200, headers=None):
+        data = json.dumps(body).encode('utf8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def inject_faults(self):
+        """ Sleeps for the configured latency, then maybe fails the call. Returns True if it failed. """
+        args = self.server.args
+        delay = args.latency + random.uniform(0, args.jitter)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+        roll = random.random()
+        if roll < args.throttle:
+            self.send_json({'error': 'Rate limit exceeded', 'code': 429}, code=429,
+                           headers={'Retry-After': str(args.retryafter)})
+            return True
+        if roll < args.throttle + args.errors:
+            self.send_json({'error': 'Internal Server Error', 'code': 500}, code=500)
+            return True
+        return False
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.read_body()
+
+        if url.path == '/identity/token':
+            token = mock_token()
+            self.send_json({'access_token': token, 'refresh_token': 'mock', 'token_type': 'Bearer',
+                            'expires_in': 3600, 'expiration': int(time.time()) + 3600})
+            return
+
+        match = re.match(r'^/v1/workspaces/([^/]+)/message$', url.path)
+        if match is None:
+            self.send_json({'error': 'Not found', 'code': 404}, code=404)
+            return
+        if self.inject_faults():
+            return
+
+        request = json.loads(body or b'{}')
+        text = (request.get('input') or {}).get('text', '')
+        context = dict(request.get('context') or {})
+        system = dict(context.get('system') or {})
+        first_turn = 'conversation_id' not in context
+
+        intents, output, visited = self.server.workspace.respond(text, first_turn)
+
+        system['dialog_turn_counter'] = system.get('dialog_turn_counter', 0) + 1
+        system['dialog_request_counter'] = system.get('dialog_request_counter', 0) + 1
+        context.setdefault('conversation_id', str(uuid.uuid4()))
+        context['system'] = system
+
+        self.send_json({'input': {'text': text}, 'intents': intents, 'entities': [], 'context': context,
+                        'output': {'text': output, 'nodes_visited': visited, 'log_messages': []}})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/v1/logs' and re.match(r'^/v1/workspaces/[^/]+/logs$', url.path) is None:
+            self.send_json({'error': 'Not found', 'code': 404}, code=404)
+            return
+        if self.inject_faults():
+            return
+
+        query = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+        logs = self.server.logs
+        lo, hi = filter_range(logs, query.get('filter'))
+        page_limit = int(query.get('page_limit', 100))
+        first = max(lo, int(query.get('cursor') or lo))
+        last = min(hi, first + page_limit)
+
+        pagination = {}
+        if last < hi:
+            query['cursor'] = str(last)
+            pagination = {'next_url': '{}?{}'.format(url.path, urlencode(query)), 'next_cursor': str(last),
+                          'matched': hi - lo}
+
+        self.send_json({'logs': logs[first:last], 'pagination': pagination})
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), AssistantHandler)
+    server.daemon_threads = True
+    server.args = args
+    server.workspace = Workspace(args.workspace)
+
+    if args.logfile is not None:
+        server.logs = RecordedLogs(args.logfile)
+    else:
+        server.logs = LogSet(count=args.logs, intents=workspace_intents(args.workspace), context_size=args.contextsize)
+
+    print(f'Serving {len(server.logs)} log records and {args.workspace} on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,209 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Smaller ways to write the Context column.
+
+Most of a context stays the same from turn to turn, yet it is usually the largest
+field of a log. Both encoders here are passed to flatten_pages() as its context
+argument and are called with each context in download order.
+
+ContextSidecar stores contexts in a separate JSONL file, content addressed like
+git. The system member, which changes every turn but is often the same across
+conversations, and the rest of the context, which rarely changes within a
+conversation, are each stored once per distinct value, keyed by their hash. Each
+context is stored as those two hashes, and the column holds only its hash.
+load_sidecar() reads the contexts back.
+
+ContextDiff writes the first turn of a conversation in full, and every later turn
+as a JSON merge patch (RFC 7386) on the turn before it, which is named by its
+request_timestamp so the rows can be sorted freely. expand_contexts() puts the
+full contexts back. As in any merge patch, members set to null come back missing.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from wa_logs.flatten import c_SYSTEM, f_conversation_id, parse_timestamp
+
+c_HASH = 'hash'
+c_VALUE = 'value'
+c_MEMBERS = 'members'
+c_BASE = '$base'
+c_PATCH = '$patch'
+
+# Sidecar name for all the members of a context that are not stored on their own.
+c_REST = '*'
+
+# Conversations to keep the last context of in diff mode. Older ones start again in full.
+default_max_conversations = 10000
+
+
+def canonical_json(value=None):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def content_hash(text=None):
+    return hashlib.blake2b(text.encode('utf8'), digest_size=8).hexdigest()
+
+
+class ContextSidecar:
+    """ Writes each distinct part of a context once to a JSONL sidecar file and returns a
+    short reference to the context for the row. Members named in separate are stored on
+    their own, and everything else together.
+    """
+
+    def __init__(self, file_name=None, separate=[c_SYSTEM]):
+        self.file_name = file_name
+        self.separate = separate
+        self.out = open(file_name, 'w', encoding='utf8')
+        self.seen = set()
+
+    def store(self, key=None, line=None):
+        if key not in self.seen:
+            self.seen.add(key)
+            self.out.write(line)
+            self.out.write('\n')
+
+    def add_value(self, value=None):
+        text = canonical_json(value)
+        key = content_hash(text)
+        self.store(key, '{{"{}":"{}","{}":{}}}'.format(c_HASH, key, c_VALUE, text))
+        return key
+
+    def __call__(self, context=None, request_timestamp=None):
+        members = {}
+        for name in self.separate:
+            if name in context:
+                members[name] = self.add_value(context[name])
+        members[c_REST] = self.add_value(dict((name, value) for name, value in context.items()
+                                              if name not in self.separate))
+
+        text = canonical_json(members)
+        key = content_hash(text)
+        self.store(key, '{{"{}":"{}","{}":{}}}'.format(c_HASH, key, c_MEMBERS, text))
+        return key
+
+    def close(self):
+        self.out.close()
+
+
+def load_sidecar(file_name=None):
+    """ Reads a ContextSidecar file back into a dict of context hash to context. """
+    values = {}
+    trees = {}
+    with open(file_name, encoding='utf8') as f:
+        for line in f:
+            entry = json.loads(line)
+            if c_MEMBERS in entry:
+                trees[entry[c_HASH]] = entry[c_MEMBERS]
+            else:
+                values[entry[c_HASH]] = entry[c_VALUE]
+
+    contexts = {}
+    for key, members in trees.items():
+        context = dict(values[members[c_REST]])
+        for name, h in members.items():
+            if name != c_REST:
+                context[name] = values[h]
+        contexts[key] = context
+    return contexts
+
+
+def merge_patch(old=None, new=None):
+    """ The JSON merge patch that turns old into new. Removed members are set to None. """
+    patch = {}
+    for name, value in new.items():
+        if name not in old:
+            patch[name] = value
+        elif old[name] != value:
+            if isinstance(value, dict) and isinstance(old[name], dict):
+                patch[name] = merge_patch(old[name], value)
+            else:
+                patch[name] = value
+    for name in old:
+        if name not in new:
+            patch[name] = None
+    return patch
+
+
+def apply_merge_patch(target=None, patch=None):
+    if not isinstance(patch, dict):
+        return patch
+
+    result = dict(target) if isinstance(target, dict) else {}
+    for name, value in patch.items():
+        if value is None:
+            result.pop(name, None)
+        else:
+            result[name] = apply_merge_patch(result.get(name), value)
+    return result
+
+
+class ContextDiff:
+    """ Writes each context as a merge patch on the previous turn of its conversation.
+
+    The last context of up to max_conversations conversations is kept. A conversation
+    that has dropped out starts again with a full context.
+    """
+
+    def __init__(self, max_conversations=default_max_conversations):
+        self.max_conversations = max_conversations
+        self.last = OrderedDict()
+
+    def __call__(self, context=None, request_timestamp=None):
+        conversation_id = context.get(f_conversation_id)
+        previous = self.last.pop(conversation_id, None)
+        self.last[conversation_id] = (request_timestamp, context)
+        if len(self.last) > self.max_conversations:
+            self.last.popitem(last=False)
+
+        if previous is None:
+            return json.dumps(context)
+        return json.dumps({c_BASE: previous[0], c_PATCH: merge_patch(previous[1], context)})
+
+    def close(self):
+        pass
+
+
+def expand_contexts(rows=None):
+    """ Puts back the full contexts of ContextDiff output.
+
+    rows are (conversation_id, request_timestamp, context text) for a whole export, in any
+    order. request_timestamp can be as the API, CSV or pandas writes it. Returns a dict of
+    (conversation_id, request_timestamp as a datetime) to context.
+    """
+    def timestamp(value):
+        return parse_timestamp(value) if isinstance(value, str) else value
+
+    encoded = dict(((conversation_id, timestamp(request_timestamp)), json.loads(text))
+                   for conversation_id, request_timestamp, text in rows if text)
+    expanded = {}
+
+    def expand(row_key):
+        # Walk back to the nearest full context, then patch forward.
+        chain = []
+        while row_key not in expanded:
+            context = encoded[row_key]
+            if c_BASE not in context:
+                expanded[row_key] = context
+                break
+            chain.append(row_key)
+            row_key = (row_key[0], timestamp(context[c_BASE]))
+        for key in reversed(chain):
+            base = (key[0], timestamp(encoded[key][c_BASE]))
+            expanded[key] = apply_merge_patch(expanded[base], encoded[key][c_PATCH])
+
+    for row_key in encoded:
+        expand(row_key)
+    return expanded
@@ -0,0 +1,162 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Drops logs that were already exported, by log_id.
+
+Every log_id seen is kept as a 16 byte digest in a SQLite table, on disk, so
+tens of millions of IDs take little memory and can be kept between runs. A Bloom
+filter in memory answers most lookups for new IDs, the usual case, without going
+to the table. The filter may say an ID was seen when it was not, but the table is
+always checked before a log is dropped, so no new log is ever lost.
+
+IDs are only committed along with the output they were written to: export()
+calls commit() whenever the writer checkpoints and once it is closed, and
+rollback() if the export fails, so a failed run never hides logs from the next.
+"""
+
+import hashlib
+import json
+import math
+import sqlite3
+
+c_LOG_ID = 'log_id'
+
+schema = '''
+create table if not exists seen (digest blob primary key) without rowid;
+create table if not exists meta (name text primary key, value blob);
+'''
+
+# IDs the Bloom filter is first sized for. It doubles, and is rebuilt from the table, as more are seen.
+default_capacity = 1000000
+default_error_rate = 0.01
+
+# SQLite's limit on the parameters of one statement, less some room.
+lookup_batch = 900
+
+
+def digest(log_id=None):
+    return hashlib.blake2b(log_id.encode('utf8'), digest_size=16).digest()
+
+
+class BloomFilter:
+    """ A Bloom filter of 16 byte digests, sized for capacity items at error_rate false positives. """
+
+    def __init__(self, capacity=default_capacity, error_rate=default_error_rate, bits=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(bits) if bits is not None else bytearray((self.size + 7) // 8)
+
+    def add(self, value=None):
+        """ Adds a digest. Returns True if it may have been added before, False if it certainly was not. """
+        # Double hashing: k positions from the two halves of the digest.
+        position = int.from_bytes(value[:8], 'little')
+        step = int.from_bytes(value[8:], 'little') | 1
+        size = self.size
+        bits = self.bits
+        present = True
+        for _ in range(self.hashes):
+            position = (position + step) % size
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                present = False
+        return present
+
+
+class LogIdSet:
+    """ The log_ids already exported, on disk at file_name, or in a temporary file for this run only. """
+
+    def __init__(self, file_name=None, capacity=default_capacity, error_rate=default_error_rate):
+        # An empty name gives a private on disk database, deleted when it is closed.
+        self.connection = sqlite3.connect(file_name or '')
+        # IDs are committed every page, so skip the sync on each commit as the log store does.
+        self.connection.execute('pragma journal_mode = wal')
+        self.connection.execute('pragma synchronous = normal')
+        self.connection.executescript(schema)
+        self.error_rate = error_rate
+        self.count = self.connection.execute('select count(*) from seen').fetchone()[0]
+        self.dropped = 0
+        self.bloom = self.load_bloom()
+        if self.bloom is None:
+            self.rebuild(max(capacity, self.count * 2))
+
+    def load_bloom(self):
+        rows = dict(self.connection.execute('select name, value from meta'))
+        if 'bloom' not in rows:
+            return None
+
+        # A run that stopped after a checkpoint can leave the saved filter behind the table.
+        info = json.loads(rows['bloom_info'])
+        if info['count'] != self.count or info['error_rate'] != self.error_rate:
+            return None
+        return BloomFilter(capacity=info['capacity'], error_rate=self.error_rate, bits=rows['bloom'])
+
+    def rebuild(self, capacity=None):
+        self.bloom = BloomFilter(capacity=capacity, error_rate=self.error_rate)
+        add = self.bloom.add
+        for value, in self.connection.execute('select digest from seen'):
+            add(value)
+
+    def filter(self, data=None):
+        """ The logs of a page that have not been seen before, which are then marked as seen. """
+        digests = [digest(o[c_LOG_ID]) if o.get(c_LOG_ID) else None for o in data]
+
+        # Only IDs the Bloom filter might have seen are looked up. Adding them to the filter
+        # straight away does no harm, as any that turn out to be seen are in it already.
+        add = self.bloom.add
+        maybe = list(set(value for value in digests if value is not None and add(value)))
+        seen = set()
+        for first in range(0, len(maybe), lookup_batch):
+            batch = maybe[first:first + lookup_batch]
+            seen.update(value for value, in self.connection.execute(
+                'select digest from seen where digest in ({})'.format(','.join('?' * len(batch))), batch))
+
+        kept = []
+        new = []
+        for o, value in zip(data, digests):
+            if value is None:
+                kept.append(o)
+            elif value in seen:
+                self.dropped += 1
+            else:
+                # Also drops a log repeated within the page.
+                seen.add(value)
+                new.append((value,))
+                kept.append(o)
+
+        self.connection.executemany('insert into seen values (?)', new)
+        self.count += len(new)
+
+        if self.count > self.bloom.capacity:
+            self.rebuild(self.bloom.capacity * 2)
+        return kept
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self, save=True):
+        """ Commits the IDs and saves the Bloom filter alongside them, unless save is False. """
+        if save:
+            info = json.dumps({'capacity': self.bloom.capacity, 'error_rate': self.error_rate, 'count': self.count})
+            self.connection.executemany('insert or replace into meta values (?, ?)',
+                                        [('bloom', bytes(self.bloom.bits)), ('bloom_info', info)])
+            self.connection.commit()
+        else:
+            self.connection.rollback()
+        self.connection.close()
@@ -0,0 +1,381 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Exports Watson Assistant logs, for use from Python as well as from export_logs_py.py.
+
+Everything takes explicit parameters and nothing happens at import time. ibm_watson
+is only imported by connect(), and pandas only by the writers that build a
+DataFrame, so a JSON or JSONL export never loads it.
+
+For example:
+
+    from wa_logs.exporter import export_logs
+    export_logs(apikey=apikey, id=workspace_id, file_name='logs.jsonl', file_type='JSONL', url=url)
+
+Or, a step at a time:
+
+    client = connect(apikey=apikey, url=url)
+    pages = log_pages(client=client, pull_filter=log_filter(id=workspace_id))
+    for record in read_records(pages):
+        ...
+"""
+
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+from wa_logs.files import atomic_write
+from wa_logs.flatten import format_timestamp, f_response_timestamp
+from wa_logs.metrics import response_size
+from wa_logs.partition import PartitionedWriter
+from wa_logs.retry import RateLimiter, call_with_retry, configure_pool, default_retries
+from wa_logs.writers import (JsonWriter, JsonlWriter, ParquetWriter, SqliteWriter, SummaryWriter, XlsxWriter, XsvWriter,
+                             require)
+
+C_DEPLOYMENT = 'DEPLOYMENT'
+C_ASSISTANT = 'ASSISTANT'
+C_WORKSPACE = 'WORKSPACE'
+C_CSV = 'CSV'
+C_TSV = 'TSV'
+C_XLSX = 'XLSX'
+C_JSON = 'JSON'
+C_JSONL = 'JSONL'
+C_PARQUET = 'PARQUET'
+C_SQLITE = 'SQLITE'
+C_FULL = 'FULL'
+C_REF = 'REF'
+C_DIFF = 'DIFF'
+
+file_types = [C_CSV, C_TSV, C_XLSX, C_JSONL, C_PARQUET, C_SQLITE, C_JSON]
+
+# File types that pages are added to as they download, so an interrupted export can carry on.
+resumable_file_types = [C_JSONL, C_SQLITE]
+summary_file_types = [C_JSON, C_CSV, C_TSV]
+
+c_LOGS = 'logs'
+c_PAGINATION = 'pagination'
+c_NEXT_URL = 'next_url'
+c_CURSOR = 'cursor'
+c_FILTER = 'filter'
+c_FILENAME = 'filename'
+c_COUNT = 'count'
+c_SINCE = 'since'
+c_TRUNCATED = 'truncated'
+
+logger = logging.getLogger(__name__)
+
+# The log field that holds the ID for each log type.
+log_type_fields = {
+    C_WORKSPACE: 'workspace_id',
+    C_ASSISTANT: 'request.context.system.assistant_id',
+    C_DEPLOYMENT: 'request.context.metadata.deployment'
+}
+
+default_version = '2020-04-01'
+default_url = 'https://gateway.watsonplatform.net/assistant/api'
+default_log_type = C_WORKSPACE
+default_language = 'en'
+default_page_limit = 200
+default_total_pages = 999
+
+
+def log_filter(log_type=default_log_type, id=None, language=default_language):
+    """ The list_all_logs filter for one workspace, assistant or deployment. Raises ValueError for an unknown log_type. """
+    if log_type.upper() not in log_type_fields:
+        raise ValueError(f"I don't understand logtype {log_type}.")
+    return 'language::{},{}::{}'.format(language, log_type_fields[log_type.upper()], id)
+
+
+def connect(apikey=None, url=default_url, version=default_version, iam_url=None, pool_size=10):
+    """ Makes a connection to Watson Assistant. """
+    from ibm_watson import AssistantV1
+    from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
+
+    authenticator = IAMAuthenticator(apikey, url=iam_url)
+    client = AssistantV1(version=version, authenticator=authenticator)
+    client.set_service_url(url)
+
+    # Threads share the client, so give each its own keep-alive connection.
+    configure_pool(client, size=pool_size)
+    return client
+
+
+def next_cursor(result=None):
+    """ The cursor of the page after this one, or None on the last page. """
+    if c_PAGINATION in result and c_NEXT_URL in result[c_PAGINATION]:
+        query = parse_qs(urlparse(result[c_PAGINATION][c_NEXT_URL]).query)
+        return query[c_CURSOR][0]
+    return None
+
+
+def read_pages(fetch=None, cursor=None, total_pages=default_total_pages, limiter=None, retries=default_retries,
+               progress=None, label='', metrics=None):
+    """ Yields pages of logs, each a list of log records.
+
+    fetch(cursor) makes the API call for one page. progress, if given, is updated with
+    the cursor of the next page before each page is handed out. metrics, an ExportMetrics
+    from wa_logs/metrics.py, gets the time, records and bytes of every page.
+    """
+    page_count = 1
+
+    x = { c_PAGINATION: 'DUMMY' }
+    while x[c_PAGINATION]:
+        if page_count > total_pages:
+            break
+
+        logger.info('Reading page %d%s.', page_count, label)
+        started = time.perf_counter()
+        response = call_with_retry(lambda: fetch(cursor), limiter=limiter, retries=retries)
+        x = response.result
+        if metrics is not None:
+            metrics.fetched(time.perf_counter() - started, records=len(x[c_LOGS]), size=response_size(response))
+
+        page_count = page_count + 1
+        cursor = next_cursor(x)
+
+        if progress is not None:
+            progress[c_CURSOR] = cursor
+
+        yield x[c_LOGS]
+
+        # Without a next page there is nothing left, even if other pagination fields came back.
+        if cursor is None:
+            break
+
+
+def log_pages(client=None, pull_filter=None, page_limit=default_page_limit, **options):
+    """ Yields pages of the logs that match pull_filter. options are passed on to read_pages. """
+    return read_pages(lambda cursor: client.list_all_logs(filter=pull_filter, cursor=cursor, page_limit=page_limit),
+                      **options)
+
+
+def read_records(pages=None):
+    """ Yields the log records of each page in turn. """
+    for page in pages:
+        yield from page
+
+
+def split_time_windows(start=None, end=None, count=1):
+    # Each boundary is formatted once, so neighbouring windows can never overlap or leave a gap.
+    step = (end - start) / count
+    bounds = [format_timestamp(start + step * i) for i in range(count)] + [format_timestamp(end)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def since_filter(pull_filter=None, since=None):
+    """ Narrows pull_filter to logs newer than since, the high water mark of an earlier export. """
+    return '{},{}>{}'.format(pull_filter, f_response_timestamp, since)
+
+
+def window_filter(pull_filter=None, window=None):
+    return '{},{}>={},{}<{}'.format(pull_filter, f_response_timestamp, window[0], f_response_timestamp, window[1])
+
+
+def window_pages(client=None, pull_filter=None, window=None, progress=None, **options):
+    """ Yields the pages of one time window. If total_pages runs out before the window does,
+    its start is added to the list at progress[c_TRUNCATED].
+    """
+    # Windows have their own cursors, which cannot be resumed from, so they are kept apart from progress.
+    window_progress = {}
+    yield from log_pages(client=client, pull_filter=window_filter(pull_filter, window), progress=window_progress,
+                         label=' of window {}'.format(window[0]), **options)
+
+    if window_progress.get(c_CURSOR) and progress is not None:
+        progress.setdefault(c_TRUNCATED, []).append(window[0])
+
+
+def read_window(client=None, pull_filter=None, window=None, **options):
+    """ All the logs of one time window, in response_timestamp order. """
+    logs = []
+    for page in window_pages(client=client, pull_filter=pull_filter, window=window, **options):
+        logs.extend(page)
+
+    logs.sort(key=lambda o: o[f_response_timestamp])
+    return logs
+
+
+def read_windows(client=None, pull_filter=None, windows=None, workers=1, **options):
+    """ Yields the logs of each time window, downloading up to workers windows at the same time.
+
+    Each window is held in memory until it is handed out, so memory grows with the window
+    size times workers. More, smaller windows keep it down.
+    """
+    windows = iter(windows)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def submit():
+            window = next(windows, None)
+            if window is not None:
+                pending.append(pool.submit(read_window, client, pull_filter, window, **options))
+
+        # Windows are handed back in order, so the output stays in timestamp order. A new
+        # one only starts as one is handed out, so no more than workers are held at once.
+        pending = deque()
+        for _ in range(workers):
+            submit()
+        while pending:
+            logs = pending.popleft().result()
+            submit()
+            yield logs
+
+
+def load_state(file_name=None):
+    if file_name is None or not os.path.exists(file_name):
+        return {}
+    with open(file_name) as f:
+        return json.load(f)
+
+
+def save_state(state=None, file_name=None):
+    # A crash must never leave a half written state file.
+    with atomic_write(file_name) as out:
+        json.dump(state, out, indent=2)
+
+
+projection_file_types = [C_CSV, C_TSV, C_XLSX, C_JSONL]
+
+
+def writer_packages(file_type=C_JSON, stream=False, sort_memory=None, projection=None):
+    """ The optional packages that the PageWriter for a file type needs. """
+    if file_type == C_PARQUET:
+        return ParquetWriter.packages()
+    elif file_type in [C_CSV, C_TSV]:
+        return XsvWriter.packages(sort_memory=sort_memory, projection=projection)
+    elif file_type == C_XLSX:
+        return XlsxWriter.packages(stream=stream, sort_memory=sort_memory, projection=projection)
+    return []
+
+
+def open_writer(file_type=C_JSON, file_name=None, strip=False, context=True, stream=False, sort_memory=None,
+                temp_dir=None, compress=False, append=False, summary=False, projection=None, partition=None):
+    """ Opens the PageWriter for a file type.
+
+    sort_memory is in bytes. context is True, False or an encoder from wa_logs/contexts.py.
+    compress and append only apply to JSONL. projection, from wa_logs/projection.py, picks
+    the columns of CSV/TSV/XLSX or the fields of JSONL. With summary, a
+    report of the logs is written instead, as JSON or CSV/TSV. partition, a dict of
+    PartitionedWriter options from wa_logs/partition.py, splits the export into many files.
+    Raises ValueError for a file type that cannot be written, and ImportError if an
+    optional package is missing.
+    """
+    file_type = file_type.upper()
+    if partition is not None:
+        if summary or append:
+            raise ValueError('a summary or a resumed export cannot be partitioned.')
+
+        # Parts are only opened as their first logs arrive, so look for their packages now.
+        require(*writer_packages(file_type=file_type, stream=stream, sort_memory=sort_memory, projection=projection))
+
+        def open_part(part_name):
+            return open_writer(file_type=file_type, file_name=part_name, strip=strip, context=context, stream=stream,
+                               sort_memory=sort_memory, temp_dir=temp_dir, compress=compress, projection=projection)
+
+        return PartitionedWriter(file_name=file_name, open_part=open_part, **partition)
+
+    if summary:
+        if file_type not in summary_file_types:
+            raise ValueError(f'--summary is written as {C_JSON}, {C_CSV} or {C_TSV}.')
+        return SummaryWriter(file_name=file_name, sep={C_JSON: None, C_CSV: ',', C_TSV: '\t'}[file_type])
+
+    if projection is not None and file_type not in projection_file_types:
+        raise ValueError(f'--columns applies to {C_CSV}, {C_TSV}, {C_XLSX} and {C_JSONL}.')
+
+    if file_type == C_JSON:
+        return JsonWriter(file_name=file_name)
+    elif file_type == C_JSONL:
+        return JsonlWriter(file_name=file_name, compress=compress, append=append, projection=projection)
+    elif file_type == C_PARQUET:
+        return ParquetWriter(file_name=file_name, strip=strip, context=context)
+    elif file_type == C_SQLITE:
+        return SqliteWriter(file_name=file_name)
+    elif file_type in [C_CSV, C_TSV]:
+        return XsvWriter(file_name=file_name, sep=',' if file_type == C_CSV else '\t', strip=strip, context=context,
+                         sort_memory=sort_memory, temp_dir=temp_dir, projection=projection)
+    elif file_type == C_XLSX:
+        return XlsxWriter(file_name=file_name, strip=strip, context=context, stream=stream, sort_memory=sort_memory,
+                          temp_dir=temp_dir, projection=projection)
+    raise ValueError(f"I don't understand filetype {file_type}.")
+
+
+def export(pages=None, writer=None, count=0, state=None, state_file=None, metrics=None, dedup=None):
+    """ Feeds pages to writer and closes it. Returns the number of records written, on top of count.
+
+    state, if given, gets the highest response_timestamp seen. With state_file, it is saved
+    after each page the writer checkpoints and at the end, when a finished export also
+    becomes the starting point for the next incremental one. An export that left a cursor
+    or a truncated window behind keeps the old starting point, so nothing is skipped. metrics, if given, is handed
+    to the writer to time its stages, and the progress is printed after each page.
+    dedup, a LogIdSet from wa_logs/dedup.py, drops logs it has seen before they reach the
+    writer, and is committed along with the output.
+    """
+    writer.metrics = metrics
+    try:
+        for page in pages:
+            if dedup is not None:
+                page = dedup.filter(page)
+            writer.add_page(page)
+            count = count + len(page)
+            if metrics is not None:
+                logger.info(metrics.written(len(page)))
+
+            if state is not None and len(page) > 0:
+                newest = max(o[f_response_timestamp] for o in page)
+                state[f_response_timestamp] = max(newest, state.get(f_response_timestamp) or newest)
+
+            # Only pages that are on disk yet can be checkpointed.
+            if state_file is not None and writer.checkpoint:
+                state[c_COUNT] = count
+                save_state(state=state, file_name=state_file)
+            if dedup is not None and writer.checkpoint:
+                dedup.commit()
+    except BaseException:
+        writer.abort()
+        if dedup is not None:
+            dedup.rollback()
+        raise
+
+    writer.close()
+    if dedup is not None:
+        dedup.commit()
+
+    if state_file is not None:
+        state[c_COUNT] = count
+        if not state.get(c_CURSOR) and not state.get(c_TRUNCATED):
+            state[c_SINCE] = state.get(f_response_timestamp, state.get(c_SINCE))
+        save_state(state=state, file_name=state_file)
+
+    return count
+
+
+def export_logs(apikey=None, id=None, file_name=None, file_type=C_JSON, log_type=default_log_type,
+                language=default_language, pull_filter=None, url=default_url, version=default_version, iam_url=None,
+                page_limit=default_page_limit, total_pages=default_total_pages, rate=5.0, max_rate=None,
+                retries=default_retries, client=None, **writer_options):
+    """ Exports the logs of a workspace, assistant or deployment to a file in one call.
+
+    pull_filter overrides log_type, id and language. client, if given, is used instead of
+    connecting again. writer_options are passed on to open_writer. Returns the number
+    of records written.
+    """
+    if pull_filter is None:
+        pull_filter = log_filter(log_type=log_type, id=id, language=language)
+    if client is None:
+        client = connect(apikey=apikey, url=url, version=version, iam_url=iam_url)
+
+    writer = open_writer(file_type=file_type, file_name=file_name, **writer_options)
+    pages = log_pages(client=client, pull_filter=pull_filter, page_limit=page_limit, total_pages=total_pages,
+                      limiter=RateLimiter(rate=rate, max_rate=max_rate), retries=retries)
+    return export(pages=pages, writer=writer)
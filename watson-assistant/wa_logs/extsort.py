@@ -0,0 +1,118 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" External merge sort for rows that do not fit in memory.
+
+Rows are buffered until a memory budget is reached, then sorted and spilled to
+a temporary CSV file (a run). Reading back merges all the runs in one stream,
+so only one row per run is held in memory at a time.
+"""
+
+import csv
+import heapq
+import os
+import sys
+import tempfile
+
+# Rough per row cost of the tuple and its strings on top of the text itself.
+row_overhead = 64 + 56 * 10
+
+# Above this many runs they are merged in several passes, to stay clear of open file limits.
+default_fanin = 64
+
+
+def estimate_row_size(row=None):
+    return row_overhead + sum(len(v) if isinstance(v, str) else 24 for v in row)
+
+
+class ExternalSorter:
+    """ Sorts rows of strings with a bounded amount of memory.
+
+    key picks the sort key out of a row, memory is the budget in bytes for the
+    rows buffered before a run is spilled to disk.
+    """
+
+    def __init__(self, key=None, memory=256 * 1024 * 1024, temp_dir=None, fanin=default_fanin):
+        self.key = key
+        self.memory = memory
+        self.temp_dir = temp_dir
+        self.fanin = fanin
+        self.buffer = []
+        self.buffer_size = 0
+        self.runs = []
+        self.count = 0
+
+    def add(self, rows=None):
+        for row in rows:
+            self.buffer.append(row)
+            self.buffer_size += estimate_row_size(row)
+            self.count += 1
+
+            if self.buffer_size >= self.memory:
+                self.spill()
+
+    def spill(self):
+        if not self.buffer:
+            return
+
+        self.buffer.sort(key=self.key)
+        self.runs.append(self.write_run(self.buffer))
+        self.buffer = []
+        self.buffer_size = 0
+
+    def write_run(self, rows=None):
+        fd, name = tempfile.mkstemp(prefix='wa_logs_run_', suffix='.csv', dir=self.temp_dir)
+        with os.fdopen(fd, 'w', encoding='utf8', newline='') as out:
+            csv.writer(out).writerows(rows)
+        return name
+
+    def read_run(self, name=None):
+        # Runs can hold large context strings.
+        csv.field_size_limit(sys.maxsize)
+        with open(name, encoding='utf8', newline='') as f:
+            for row in csv.reader(f):
+                yield row
+
+    def merge_runs(self, names=None):
+        return heapq.merge(*[self.read_run(name) for name in names], key=self.key)
+
+    def __iter__(self):
+        # Everything fits in memory, so skip the disk altogether.
+        if not self.runs:
+            self.buffer.sort(key=self.key)
+            yield from self.buffer
+            return
+
+        self.spill()
+
+        while len(self.runs) > self.fanin:
+            names, self.runs = self.runs[:self.fanin], self.runs[self.fanin:]
+            self.runs.append(self.write_run(self.merge_runs(names)))
+            for name in names:
+                os.remove(name)
+
+        yield from self.merge_runs(self.runs)
+
+    def close(self):
+        for name in self.runs:
+            if os.path.exists(name):
+                os.remove(name)
+        self.runs = []
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,42 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Writing small files that other programs, or the next run, may read at any time.
+
+State files, manifests and Prometheus textfiles are replaced whole. atomic_write
+writes the new content to a temporary file next to the old one and renames it
+over the old one once it is safely on disk, so a reader or a crash only ever
+sees the old file or the new one, never half of one.
+"""
+
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(file_name=None, mode='w'):
+    """ Yields a file to write the whole of file_name to. It replaces file_name when the block ends,
+    or is thrown away if the block raises. Only one thread may write a file_name at a time.
+    """
+    temp_name = file_name + '.tmp'
+    try:
+        with open(temp_name, mode) as out:
+            yield out
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(temp_name, file_name)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
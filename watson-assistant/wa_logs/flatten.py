@@ -0,0 +1,225 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Flattens Watson Assistant log records into export columns.
+
+Records are extracted page by page into column lists that are allocated once
+for the whole export. Timestamps are then parsed in one pass per column,
+instead of building a dict per log and cleaning up the DataFrame afterwards.
+pandas and numpy are only imported by the functions that build DataFrames.
+"""
+
+import json
+import logging
+from datetime import datetime, timezone
+from wa_logs.metrics import c_FLATTEN, c_SORT, timed
+
+c_RESPONSE = 'response'
+c_CONTEXT = 'context'
+c_SYSTEM = 'system'
+c_INPUT = 'input'
+c_OUTPUT = 'output'
+c_INTENTS = 'intents'
+c_INTENT = 'intent'
+c_TEXT = 'text'
+c_BRANCH_EXITED_REASON = 'branch_exited_reason'
+c_LOG_MESSAGING = 'log_messaging'
+c_CONFIDENCE = 'confidence'
+
+f_conversation_id = 'conversation_id'
+f_request_timestamp = 'request_timestamp'
+f_response_timestamp = 'response_timestamp'
+f_user_input = 'User Input'
+f_output = 'Output'
+f_intent = 'Intent'
+f_confidence = 'Confidence'
+f_exit_reason = 'Exit Reason'
+f_logging = 'Logging'
+f_context = 'Context'
+
+columns = [
+    f_conversation_id, f_request_timestamp, f_response_timestamp,
+    f_user_input, f_output, f_intent, f_confidence, f_exit_reason, f_logging, f_context
+]
+
+logger = logging.getLogger(__name__)
+
+# Watson Assistant always writes timestamps in UTC like 2020-04-01T12:00:00.123Z.
+c_UTC_SUFFIX = 'Z'
+
+
+def parse_timestamp(value=None):
+    """ Parses one ISO 8601 timestamp into an aware UTC datetime. Times without a zone are taken as UTC. """
+    # fromisoformat() before python 3.11 does not accept the Z suffix.
+    ts = datetime.fromisoformat(value.replace(c_UTC_SUFFIX, '+00:00'))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc)
+
+
+def format_timestamp(ts=None):
+    """ Writes a datetime the way the API does. """
+    return ts.strftime('%Y-%m-%dT%H:%M:%S.') + '{:03d}Z'.format(ts.microsecond // 1000)
+
+
+def flatten_pages(data=None, strip=False, context=True, missing=''):
+    """ Flattens a list of pages of log records into a dict of column lists.
+
+    Fields that a record does not have are set to missing. If context is False,
+    the Context column is left as missing instead of serializing every context.
+    context can also be a function, called with each context and the request
+    timestamp, that returns the text to write instead (see wa_logs/contexts.py).
+    """
+    total = sum(len(page) for page in data)
+    conversation_id = [missing] * total
+    request_timestamp = [missing] * total
+    response_timestamp = [missing] * total
+    user_input = [missing] * total
+    output = [missing] * total
+    intent = [missing] * total
+    confidence = [missing] * total
+    exit_reason = [missing] * total
+    logging = [missing] * total
+    contexts = [missing] * total
+
+    dumps = json.dumps
+    encode = context if callable(context) else None
+    i = 0
+    for page in data:
+        for o in page:
+            r = o[c_RESPONSE]
+            rc = r[c_CONTEXT]
+            ro = r[c_OUTPUT]
+
+            conversation_id[i] = rc[f_conversation_id]
+            request_timestamp[i] = o[f_request_timestamp]
+            response_timestamp[i] = o[f_response_timestamp]
+
+            text = r[c_INPUT].get(c_TEXT)
+            if text is not None:
+                user_input[i] = text
+
+            text = ro.get(c_TEXT)
+            if text is not None:
+                text = ' '.join(text)
+                if strip:
+                    text = text.replace('\\l', '').replace('\n', '').replace('\r', '')
+                output[i] = text
+
+            intents = r[c_INTENTS]
+            if intents:
+                confidence[i] = intents[0][c_CONFIDENCE]
+                intent[i] = intents[0][c_INTENT]
+
+            reason = rc[c_SYSTEM].get(c_BRANCH_EXITED_REASON)
+            if reason is not None:
+                exit_reason[i] = reason
+
+            if c_LOG_MESSAGING in ro:
+                logging[i] = ro[c_LOG_MESSAGING]
+
+            if encode is not None:
+                contexts[i] = encode(rc, o[f_request_timestamp])
+            elif context:
+                contexts[i] = dumps(rc)
+
+            i += 1
+
+    return {
+        f_conversation_id: conversation_id, f_request_timestamp: request_timestamp,
+        f_response_timestamp: response_timestamp, f_user_input: user_input, f_output: output,
+        f_intent: intent, f_confidence: confidence, f_exit_reason: exit_reason, f_logging: logging,
+        f_context: contexts
+    }
+
+
+def parse_timestamps(values=None):
+    """ Parses a whole column of timestamps at once.
+
+    numpy parses the ISO 8601 text directly, which is several times faster than
+    pandas working out the format. Anything that is not plain UTC falls back to pandas.
+    """
+    import numpy as np
+    import pandas as pd
+
+    try:
+        if all(ts.endswith(c_UTC_SUFFIX) for ts in values):
+            parsed = np.array([ts[:-1] for ts in values], dtype='datetime64[ms]').astype('datetime64[ns]')
+            return pd.DatetimeIndex(parsed).tz_localize('UTC')
+    except ValueError:
+        pass
+
+    return pd.to_datetime(values)
+
+
+def convert_json_to_dataframe(data=None, strip=False, parse_dates=True, context=True, metrics=None):
+    """ Builds the export DataFrame from a list of pages of log records.
+
+    Returns None if there are no logs. Rows are sorted by conversation and then
+    request time, so that the logs read as conversations.
+    """
+    import pandas as pd
+
+    with timed(metrics, c_FLATTEN):
+        page = flatten_pages(data, strip=strip, context=context)
+
+        if len(page[f_conversation_id]) == 0:
+            logger.warning('No Logs found. :(')
+            return None
+
+        # Prevent timezone limitation in to_excel call by leaving dates as text.
+        if parse_dates:
+            page[f_request_timestamp] = parse_timestamps(page[f_request_timestamp])
+            page[f_response_timestamp] = parse_timestamps(page[f_response_timestamp])
+
+        df = pd.DataFrame(page, columns=columns)
+
+    with timed(metrics, c_SORT):
+        return df.sort_values([f_conversation_id, f_request_timestamp], ascending=[True, True])
+
+
+def format_csv_timestamp(ts=None):
+    """ Writes an API timestamp the way pandas writes a parsed one to CSV. """
+    if len(ts) == 24 and ts.endswith(c_UTC_SUFFIX):
+        # pandas leaves the fraction off when it is zero.
+        if ts[20:23] == '000':
+            return '{} {}+00:00'.format(ts[:10], ts[11:19])
+        return '{} {}000+00:00'.format(ts[:10], ts[11:-1])
+
+    import pandas as pd
+    return str(pd.Timestamp(ts))
+
+
+def csv_rows(data=None, strip=False, context=True):
+    """ Flattens one page of log records into rows of text, in export column order.
+
+    The text matches what convert_json_to_dataframe followed by to_csv writes, so
+    rows can be sorted and written without building a DataFrame.
+    """
+    page = flatten_pages([data], strip=strip, context=context)
+    page[f_request_timestamp] = [format_csv_timestamp(ts) for ts in page[f_request_timestamp]]
+    page[f_response_timestamp] = [format_csv_timestamp(ts) for ts in page[f_response_timestamp]]
+
+    return [tuple(v if isinstance(v, str) else str(v) for v in row) for row in zip(*[page[c] for c in columns])]
+
+
+def xlsx_rows(data=None, strip=False, context=True):
+    """ Flattens one page of log records into rows for a spreadsheet, in export column order.
+
+    Timestamps stay as the API text, as Excel cannot store time zones.
+    """
+    page = flatten_pages([data], strip=strip, context=context)
+    page[f_logging] = [v if isinstance(v, str) else str(v) for v in page[f_logging]]
+
+    return list(zip(*[page[c] for c in columns]))
@@ -0,0 +1,202 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Timings for an export, to find out where a slow one spends its time.
+
+ExportMetrics records every page fetched (latency, records and response bytes)
+and the time spent in each stage of the pipeline:
+
+* fetch: the API call, including retries and the JSON decoding done by the SDK.
+* flatten: turning log records into rows or columns.
+* sort: sorting rows by conversation, in a DataFrame or on disk.
+* write: writing the output file.
+* compress: compressing finished partitions, on background threads.
+
+When windows are downloaded by several workers, their fetch times are added up,
+as are the times of partitions compressed at once, so stage times can total more
+than the elapsed time. The results can be written as a JSON report and as a
+Prometheus textfile, for the node exporter's textfile collector.
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from wa_logs.files import atomic_write
+
+c_FETCH = 'fetch'
+c_FLATTEN = 'flatten'
+c_SORT = 'sort'
+c_WRITE = 'write'
+c_COMPRESS = 'compress'
+
+stages = [c_FETCH, c_FLATTEN, c_SORT, c_WRITE, c_COMPRESS]
+
+prometheus_prefix = 'wa_logs_export'
+
+
+@contextmanager
+def timed(metrics=None, stage=None):
+    """ Adds the time spent in the block to a stage of metrics, if there is one. """
+    if metrics is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_time(stage, time.perf_counter() - started)
+
+
+def response_size(response=None):
+    """ Bytes in the body of an SDK response, or None if the server did not say. """
+    headers = response.get_headers() if hasattr(response, 'get_headers') else None
+    try:
+        return int(headers.get('Content-Length')) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+def format_duration(seconds=None):
+    seconds = int(round(seconds))
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def quantile(ordered=None, q=None):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ExportMetrics:
+    """ Collects the timings of one export. Safe to share between worker threads.
+
+    expected, if known, is the most records this run can write, which the ETA is
+    worked out against.
+    """
+
+    def __init__(self, expected=None):
+        self.expected = expected
+        self.started = time.time()
+        self.finished = None
+        self.success = None
+        self.pages = []
+        self.stage_seconds = dict((stage, 0.0) for stage in stages)
+        self.records = 0
+        self.lock = threading.Lock()
+
+    def add_time(self, stage=None, seconds=None):
+        with self.lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    def fetched(self, seconds=None, records=None, size=None):
+        """ Records one page downloaded from the API. """
+        with self.lock:
+            self.stage_seconds[c_FETCH] += seconds
+            self.pages.append({'page': len(self.pages) + 1, 'seconds': round(seconds, 4), 'records': records,
+                               'bytes': size})
+
+    def written(self, records=None):
+        """ Records one page handed to the writer, and returns a progress line. """
+        with self.lock:
+            self.records += records
+            elapsed = time.time() - self.started
+            rate = self.records / elapsed if elapsed > 0 else 0.0
+
+        line = '{:,} records at {:,.0f} records/s'.format(self.records, rate)
+        if self.expected and rate > 0:
+            remaining = max(0, self.expected - self.records)
+            line += ', ETA {} for up to {:,} records'.format(format_duration(remaining / rate), self.expected)
+        return line + '.'
+
+    def finish(self, success=True):
+        self.finished = time.time()
+        self.success = success
+
+    def report(self):
+        """ The metrics as a dict that can be written as JSON. """
+        elapsed = (self.finished or time.time()) - self.started
+        latencies = sorted(page['seconds'] for page in self.pages)
+        sizes = [page['bytes'] for page in self.pages if page['bytes'] is not None]
+
+        latency = {'count': len(latencies)}
+        if latencies:
+            latency.update({'mean': round(sum(latencies) / len(latencies), 4), 'p50': quantile(latencies, 0.5),
+                            'p90': quantile(latencies, 0.9), 'p99': quantile(latencies, 0.99), 'max': latencies[-1]})
+
+        return {
+            'success': self.success,
+            'started': self.started,
+            'elapsed_seconds': round(elapsed, 3),
+            'records': self.records,
+            'pages': len(self.pages),
+            'bytes': sum(sizes) if sizes else None,
+            'records_per_second': round(self.records / elapsed, 1) if elapsed > 0 else None,
+            'stage_seconds': dict((stage, round(seconds, 3)) for stage, seconds in self.stage_seconds.items()),
+            'page_latency_seconds': latency,
+            'page_list': self.pages
+        }
+
+    def prometheus(self, labels=None):
+        """ The metrics in the Prometheus text exposition format. """
+        report = self.report()
+        label_text = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for name, value in sorted((labels or {}).items()))
+
+        def sample(name, value, extra=''):
+            inner = ','.join(part for part in [label_text, extra] if part)
+            return '{}_{}{} {}'.format(prometheus_prefix, name, '{' + inner + '}' if inner else '', value)
+
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {prometheus_prefix}_{name} {help_text}')
+            lines.append(f'# TYPE {prometheus_prefix}_{name} {kind}')
+            lines.extend(samples)
+
+        metric('success', 'gauge', '1 if the last export finished, 0 if it failed.',
+               [sample('success', 1 if report['success'] else 0)])
+        metric('last_run_timestamp_seconds', 'gauge', 'When the last export finished.',
+               [sample('last_run_timestamp_seconds', round(self.finished or time.time(), 3))])
+        metric('duration_seconds', 'gauge', 'Elapsed time of the last export.',
+               [sample('duration_seconds', report['elapsed_seconds'])])
+        metric('records', 'gauge', 'Records written by the last export.', [sample('records', report['records'])])
+        metric('pages', 'gauge', 'Pages fetched by the last export.', [sample('pages', report['pages'])])
+        if report['bytes'] is not None:
+            metric('response_bytes', 'gauge', 'Response bytes fetched by the last export.',
+                   [sample('response_bytes', report['bytes'])])
+        metric('records_per_second', 'gauge', 'Throughput of the last export.',
+               [sample('records_per_second', report['records_per_second'] or 0)])
+        metric('stage_seconds', 'gauge', 'Time spent in each stage of the last export.',
+               [sample('stage_seconds', seconds, f'stage="{stage}"')
+                for stage, seconds in report['stage_seconds'].items()])
+
+        latencies = sorted(page['seconds'] for page in self.pages)
+        samples = [sample('page_latency_seconds', quantile(latencies, q), f'quantile="{q}"')
+                   for q in [0.5, 0.9, 0.99]] if latencies else []
+        samples.append(sample('page_latency_seconds_sum', round(sum(latencies), 4)))
+        samples.append(sample('page_latency_seconds_count', len(latencies)))
+        metric('page_latency_seconds', 'summary', 'Time to fetch each page, including retries.', samples)
+
+        return '\n'.join(lines) + '\n'
+
+    def save(self, file_name=None, prometheus_file=None, labels=None):
+        """ Writes the JSON report and/or the Prometheus textfile. """
+        if file_name is not None:
+            with atomic_write(file_name) as out:
+                json.dump(self.report(), out, indent=2)
+
+        if prometheus_file is not None:
+            # The textfile collector may read at any time, so never leave a half written file.
+            with atomic_write(prometheus_file) as out:
+                out.write(self.prometheus(labels=labels))
@@ -0,0 +1,259 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Splits an export into many smaller files.
+
+PartitionedWriter starts a new file, of any output type, whenever the current
+one reaches max_records logs or the next log would take it past max_bytes of log
+JSON, and, with by_day, for each day of request_timestamp. The size is measured
+on the logs as the API returns them, which is the file size for JSONL and an
+upper bound for the other types. A single log larger than max_bytes gets a file
+of its own.
+
+Files are named after the export file, with the day if any and a sequence
+number, as in logs-00001.csv or logs-2020-04-01-00001.csv. Each finished file is
+compressed on a pool of background threads while the download carries on. A
+manifest next to them, as in logs.manifest.json, lists every file with its row
+count and request_timestamp range. It is rewritten as each file is finished, so
+it always describes the complete files on disk.
+"""
+
+import gzip
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from wa_logs.files import atomic_write
+from wa_logs.flatten import f_request_timestamp
+from wa_logs.metrics import c_COMPRESS, timed
+from wa_logs.writers import PageWriter
+
+C_GZIP = 'GZIP'
+C_ZSTD = 'ZSTD'
+
+compressions = [C_GZIP, C_ZSTD]
+compression_extensions = {C_GZIP: '.gz', C_ZSTD: '.zst'}
+
+c_FILE = 'file'
+c_DAY = 'day'
+c_RECORDS = 'records'
+c_BYTES = 'bytes'
+c_FIRST = 'first_request_timestamp'
+c_LAST = 'last_request_timestamp'
+
+copy_buffer = 1024 * 1024
+
+
+def compress_file(file_name=None, compression=C_GZIP):
+    """ Compresses a file next to itself and removes it. Returns the new file name.
+    Raises ImportError for ZSTD without zstandard.
+    """
+    target = file_name + compression_extensions[compression]
+    with open(file_name, 'rb') as f, open(target, 'wb') as out:
+        if compression == C_ZSTD:
+            import zstandard
+            zstandard.ZstdCompressor().copy_stream(f, out)
+        else:
+            # zlib lets go of the GIL, so files compress in parallel with the download.
+            with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6) as zipped:
+                shutil.copyfileobj(f, zipped, copy_buffer)
+    os.remove(file_name)
+    return target
+
+
+def manifest_name(file_name=None):
+    return os.path.splitext(file_name)[0] + '.manifest.json'
+
+
+def record_size(o=None):
+    # The line JSONL writes for the log.
+    return len(json.dumps(o)) + 1
+
+
+class Partition:
+    """ One output file while it is being written. """
+
+    def __init__(self, writer=None, entry=None):
+        self.writer = writer
+        self.entry = entry
+        self.records = 0
+        self.size = 0
+
+
+class PartitionedWriter(PageWriter):
+    """ Writes an export as a series of files, each opened by open_part(file_name).
+
+    A file is finished once it holds max_records logs or the next log would take it
+    past max_bytes of log JSON. With by_day, each day of request_timestamp also gets
+    its own files. At most max_days of them are open at once; when logs are not in
+    time order, the least recently written is finished to make room, and a later log
+    for its day starts a new file. compression, GZIP or ZSTD, compresses each
+    finished file on workers background threads. Raises ValueError for limits or
+    workers below 1, and ImportError for ZSTD without zstandard.
+    """
+
+    def __init__(self, file_name=None, open_part=None, max_records=None, max_bytes=None, by_day=False,
+                 compression=None, workers=2, max_days=4):
+        for name, value in [('max_records', max_records), ('max_bytes', max_bytes), ('workers', workers),
+                            ('max_days', max_days)]:
+            if value is not None and value < 1:
+                raise ValueError(f'{name} must be at least 1, not {value}.')
+        if compression == C_ZSTD:
+            import zstandard  # noqa: F401
+
+        self.stem, self.extension = os.path.splitext(file_name)
+        self.manifest_file = manifest_name(file_name)
+        self.open_part = open_part
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.by_day = by_day
+        self.max_days = max_days
+        self.compression = compression
+        self.pool = ThreadPoolExecutor(max_workers=workers) if compression is not None else None
+        self.futures = []
+        self.lock = threading.Lock()
+        self.entries = []
+        self.open = {}
+        self.sequence = {}
+
+    def part_name(self, day=None):
+        self.sequence[day] = self.sequence.get(day, 0) + 1
+        return '{}{}-{:05d}{}'.format(self.stem, '-' + day if day is not None else '', self.sequence[day],
+                                      self.extension)
+
+    def start(self, day=None):
+        entry = {c_FILE: self.part_name(day), c_RECORDS: 0, c_BYTES: None, c_FIRST: None, c_LAST: None}
+        if day is not None:
+            entry[c_DAY] = day
+
+        writer = self.open_part(entry[c_FILE])
+        writer.metrics = self.metrics
+        with self.lock:
+            self.entries.append(entry)
+        self.open[day] = Partition(writer=writer, entry=entry)
+        return self.open[day]
+
+    def finish(self, day=None):
+        part = self.open.pop(day)
+        part.writer.close()
+        if not os.path.exists(part.entry[c_FILE]):
+            # Some writers leave an empty export out.
+            with self.lock:
+                self.entries.remove(part.entry)
+            return
+
+        if self.pool is None:
+            self.finished(part.entry, part.entry[c_FILE])
+        else:
+            self.futures.append(self.pool.submit(self.compress, part.entry))
+
+    def compress(self, entry=None):
+        with timed(self.metrics, c_COMPRESS):
+            self.finished(entry, compress_file(entry[c_FILE], self.compression))
+
+    def finished(self, entry=None, file_name=None):
+        with self.lock:
+            entry[c_FILE] = file_name
+            entry[c_BYTES] = os.path.getsize(file_name)
+            self.save_manifest()
+
+    def save_manifest(self):
+        # Only files that are complete on disk are listed.
+        done = [entry for entry in self.entries if entry[c_BYTES] is not None]
+        with atomic_write(self.manifest_file) as out:
+            json.dump({'partitions': done, c_RECORDS: sum(entry[c_RECORDS] for entry in done)}, out, indent=2)
+
+    def add_page(self, data=None):
+        groups = {}
+        if self.by_day:
+            for o in data:
+                groups.setdefault(o[f_request_timestamp][:10], []).append(o)
+
+            # Logs come in about time order, so a day older than this whole page is done.
+            if groups:
+                oldest = min(groups)
+                for day in [day for day in self.open if day < oldest]:
+                    self.finish(day)
+        else:
+            groups[None] = data
+
+        for day, logs in groups.items():
+            # Keep the open files in the order they were last written.
+            if day in self.open:
+                self.open[day] = self.open.pop(day)
+            self.add_logs(day, logs)
+
+        while len(self.open) > self.max_days:
+            self.finish(next(iter(self.open)))
+
+    def add_logs(self, day=None, logs=None):
+        while logs:
+            part = self.open.get(day) or self.start(day)
+
+            # Fill the file up to max_records, and then start the next one.
+            take = len(logs)
+            if self.max_records is not None:
+                take = min(take, self.max_records - part.records)
+            sizes = None
+            full = False
+            if self.max_bytes is not None:
+                sizes = [record_size(o) for o in logs[:take]]
+                total = part.size
+                for i, size in enumerate(sizes):
+                    # Stop before the log that would go past max_bytes, unless the file has nothing in it yet.
+                    if total + size > self.max_bytes and (i > 0 or part.records > 0):
+                        take = i
+                        full = True
+                        break
+                    total += size
+
+            chunk = logs[:take]
+            logs = logs[take:]
+            if chunk:
+                part.writer.add_page(chunk)
+                part.records += len(chunk)
+                part.size += sum(sizes[:take]) if sizes is not None else 0
+
+                timestamps = [o[f_request_timestamp] for o in chunk]
+                if part.entry[c_FIRST] is not None:
+                    timestamps += [part.entry[c_FIRST], part.entry[c_LAST]]
+                with self.lock:
+                    part.entry.update({c_RECORDS: part.records, c_FIRST: min(timestamps), c_LAST: max(timestamps)})
+
+            if (full or (self.max_records is not None and part.records >= self.max_records)
+                    or (self.max_bytes is not None and part.size >= self.max_bytes)):
+                self.finish(day)
+
+    def wait(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            for future in self.futures:
+                future.result()
+
+    def close(self):
+        try:
+            for day in sorted(self.open, key=lambda day: day or ''):
+                self.finish(day)
+        finally:
+            self.wait()
+        with self.lock:
+            self.save_manifest()
+
+    def abort(self):
+        # Finished files are complete, so keep them and their manifest.
+        for part in self.open.values():
+            part.writer.abort()
+        self.open = {}
+        self.wait()
@@ -0,0 +1,138 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" User chosen export columns.
+
+A column spec is a JSON list. Each entry is either a dotted path into the log
+record, which also names the column, or an object with a name, a path and a
+default for logs that do not have the field. Numbers in a path index lists.
+
+    [
+        "response.context.metadata.user_id",
+        {"name": "Intent", "path": "response.intents.0.intent", "default": "(none)"},
+        {"name": "Entities", "path": "response.entities", "default": []}
+    ]
+
+The spec is compiled once into a single python function that pulls every column
+out of a record, so only the fields asked for are touched. Objects and lists are
+written as JSON text in tabular files, and left as they are in JSONL.
+"""
+
+import json
+from wa_logs.flatten import c_CONTEXT, c_RESPONSE, f_conversation_id, f_request_timestamp
+
+c_NAME = 'name'
+c_PATH = 'path'
+c_DEFAULT = 'default'
+
+
+def parse_path(path=None):
+    """ Splits a dotted path into keys, with numbers as list indexes. """
+    if not isinstance(path, str) or not path:
+        raise ValueError(f'column path {path!r} is not a dotted path.')
+
+    keys = []
+    for key in path.split('.'):
+        if not key:
+            raise ValueError(f'column path {path!r} has an empty part.')
+        keys.append(int(key) if key.isdigit() else key)
+    return keys
+
+
+def parse_spec(spec=None):
+    """ Checks a column spec. Returns a list of (name, keys, default). Raises ValueError if it is not valid. """
+    if not isinstance(spec, list) or not spec:
+        raise ValueError('a column spec must be a list of columns.')
+
+    parsed = []
+    for column in spec:
+        if isinstance(column, str):
+            column = {c_NAME: column, c_PATH: column}
+        if not isinstance(column, dict) or c_PATH not in column:
+            raise ValueError(f'column {column!r} needs a {c_PATH}.')
+        parsed.append((column.get(c_NAME, column[c_PATH]), parse_path(column[c_PATH]), column.get(c_DEFAULT, '')))
+
+    names = [name for name, _, _ in parsed]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise ValueError('column names must be unique, not {}.'.format(', '.join(duplicates)))
+    return parsed
+
+
+def compile_extractor(spec=None, dump=True):
+    """ Compiles a parsed spec into a function that returns a record's columns as a tuple.
+    With dump, objects and lists are turned into JSON text.
+    """
+    lines = ['def extract(o):']
+    for i, (_, keys, _) in enumerate(spec):
+        lookup = ''.join('[{!r}]'.format(key) for key in keys)
+        lines += [
+            '    try:',
+            f'        v{i} = o{lookup}',
+            '    except (KeyError, IndexError, TypeError):',
+            f'        v{i} = d{i}',
+            f'    if v{i} is None:',
+            f'        v{i} = d{i}',
+        ]
+        if dump:
+            lines += [
+                f'    elif v{i}.__class__ is dict or v{i}.__class__ is list:',
+                f'        v{i} = dumps(v{i})',
+            ]
+    lines.append('    return ({},)'.format(', '.join(f'v{i}' for i in range(len(spec)))))
+
+    # Defaults are written the same way as the values they stand in for.
+    namespace = {'dumps': json.dumps}
+    for i, (_, _, default) in enumerate(spec):
+        namespace[f'd{i}'] = json.dumps(default) if dump and isinstance(default, (dict, list)) else default
+
+    exec(compile('\n'.join(lines), '<column spec>', 'exec'), namespace)
+    return namespace['extract']
+
+
+class Projection:
+    """ The compiled columns of a spec. """
+
+    def __init__(self, spec=None):
+        parsed = parse_spec(spec)
+        self.names = [name for name, _, _ in parsed]
+        self.extract = compile_extractor(parsed)
+        self.extract_json = compile_extractor(parsed, dump=False)
+
+    def rows(self, data=None):
+        """ One tuple of column values per log record. """
+        extract = self.extract
+        return [extract(o) for o in data]
+
+    def records(self, data=None):
+        """ One dict of column values per log record. """
+        extract = self.extract_json
+        names = self.names
+        return [dict(zip(names, extract(o))) for o in data]
+
+    def sort_rows(self, data=None):
+        """ Rows led by the conversation ID and request time, to sort on before they are written. """
+        extract = self.extract
+        return [(o[c_RESPONSE][c_CONTEXT].get(f_conversation_id, ''), o[f_request_timestamp]) + extract(o)
+                for o in data]
+
+
+def load_projection(file_name=None):
+    """ Reads and compiles a column spec file. Raises ValueError if the spec is not valid. """
+    with open(file_name) as f:
+        try:
+            spec = json.load(f)
+        except json.JSONDecodeError as error:
+            raise ValueError(f'{file_name} is not JSON: {error}')
+    return Projection(spec)
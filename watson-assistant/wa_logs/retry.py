@@ -0,0 +1,158 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Retry, backoff and pacing for Watson Assistant API calls.
+
+call_with_retry() retries throttled (429), server (5xx) and connection errors
+with jittered exponential backoff, and waits as long as Retry-After asks. A
+shared RateLimiter paces every call. It starts at a given rate, speeds up a
+little on each success and halves on each 429, so it settles close to the
+highest rate the service will sustain.
+"""
+
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import requests
+
+retry_codes = [429, 500, 502, 503, 504]
+c_RETRY_AFTER = 'Retry-After'
+
+default_retries = 5
+default_backoff = 1.0
+default_max_backoff = 60.0
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """ Adaptive token bucket, shared by every thread making calls.
+
+    rate is the starting number of calls per second. Each success adds increase
+    to it, up to max_rate, and each throttle multiplies it by decrease, down to min_rate.
+    """
+
+    def __init__(self, rate=5.0, max_rate=None, min_rate=0.1, increase=0.2, decrease=0.5):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        # At most one second of burst.
+        self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def success(self):
+        with self.lock:
+            self.rate = self.rate + self.increase
+            if self.max_rate is not None:
+                self.rate = min(self.rate, self.max_rate)
+
+    def throttled(self):
+        with self.lock:
+            self.refill()
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0.0)
+
+
+def retry_after(error=None):
+    """ Seconds asked for by the Retry-After header of a failed call, or None. """
+    response = getattr(error, 'http_response', None)
+    value = response.headers.get(c_RETRY_AFTER) if response is not None else None
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_retry(function=None, limiter=None, retries=default_retries, backoff=default_backoff,
+                    max_backoff=default_max_backoff):
+    """ Calls function(), retrying errors that are worth another try.
+
+    Anything that is not a 429, a 5xx or a connection problem is raised straight away,
+    as is the last error once retries run out.
+    """
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+
+        try:
+            result = function()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as error:
+            if attempt == retries:
+                raise
+            reason = type(error).__name__
+            delay = None
+        except Exception as error:
+            code = getattr(error, 'code', None)
+            if code not in retry_codes or attempt == retries:
+                raise
+            if code == 429 and limiter is not None:
+                limiter.throttled()
+            reason = f'HTTP {code}'
+            delay = retry_after(error)
+        else:
+            if limiter is not None:
+                limiter.success()
+            return result
+
+        # Full jitter keeps parallel workers from retrying in lock step.
+        if delay is None:
+            delay = random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+
+        logger.warning('%s, retrying in %.1fs (%d of %d).', reason, delay, attempt + 1, retries)
+        time.sleep(delay)
+
+
+def configure_pool(client=None, size=10):
+    """ Lets up to size threads share the keep-alive connections of one client. """
+    try:
+        from ibm_cloud_sdk_core.http_adapter import SSLHTTPAdapter
+    except ImportError:
+        # Older SDKs manage their own sessions.
+        return
+
+    adapter = SSLHTTPAdapter(pool_connections=size, pool_maxsize=size,
+                             _disable_ssl_verification=client.disable_ssl_verification)
+    client.http_adapter = adapter
+    client.http_client.mount('http://', adapter)
+    client.http_client.mount('https://', adapter)
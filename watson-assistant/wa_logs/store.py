@@ -0,0 +1,127 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" A local SQLite store of exported logs.
+
+Logs are upserted by log_id, one transaction per page, so exporting the same
+logs again updates them instead of adding copies, and repeated incremental
+exports grow one store. Each log keeps its flattened columns for querying and
+the whole record as JSON. Timestamps are stored as the API text, which sorts in
+time order, and are indexed along with conversation, intent and exit reason.
+
+For example, from python:
+
+    connection = open_store('logs.db')
+    turns = conversation_turns(connection, conversation_id)
+    fallbacks = find_logs(connection, intent='fallback', start='2020-04-07', end='2020-04-08')
+
+Or with the sqlite3 shell:
+
+    sqlite3 logs.db "select intent, count(*) from logs group by intent order by 2 desc"
+"""
+
+import json
+import sqlite3
+from wa_logs.flatten import (flatten_pages, f_conversation_id, f_request_timestamp, f_response_timestamp,
+                             f_user_input, f_output, f_intent, f_confidence, f_exit_reason)
+
+c_LOG_ID = 'log_id'
+c_WORKSPACE_ID = 'workspace_id'
+
+# SQL column for each export column.
+store_columns = [
+    (f_conversation_id, 'conversation_id'), (f_request_timestamp, 'request_timestamp'),
+    (f_response_timestamp, 'response_timestamp'), (f_user_input, 'user_input'), (f_output, 'output'),
+    (f_intent, 'intent'), (f_confidence, 'confidence'), (f_exit_reason, 'exit_reason')
+]
+
+schema = '''
+create table if not exists logs (
+    log_id text primary key,
+    workspace_id text,
+    conversation_id text,
+    request_timestamp text,
+    response_timestamp text,
+    user_input text,
+    output text,
+    intent text,
+    confidence real,
+    exit_reason text,
+    record text not null
+);
+create index if not exists logs_conversation on logs (conversation_id, request_timestamp);
+create index if not exists logs_request_timestamp on logs (request_timestamp);
+create index if not exists logs_intent on logs (intent, request_timestamp);
+create index if not exists logs_exit_reason on logs (exit_reason, request_timestamp);
+'''
+
+names = [c_LOG_ID, c_WORKSPACE_ID] + [name for _, name in store_columns] + ['record']
+upsert = 'insert into logs ({}) values ({}) on conflict (log_id) do update set {}'.format(
+    ', '.join(names), ', '.join('?' * len(names)),
+    ', '.join('{0} = excluded.{0}'.format(name) for name in names[1:]))
+
+
+def open_store(file_name=None):
+    """ Opens, or creates, a log store. """
+    connection = sqlite3.connect(file_name)
+    # The write ahead log lets readers query the store while an export is writing to it.
+    connection.execute('pragma journal_mode = wal')
+    connection.execute('pragma synchronous = normal')
+    connection.executescript(schema)
+    return connection
+
+
+def save_store_page(data=None, connection=None):
+    """ Upserts one page of log records in a single transaction. """
+    if len(data) == 0:
+        return
+
+    page = flatten_pages([data], context=False, missing=None)
+    rows = zip([o.get(c_LOG_ID) for o in data], [o.get(c_WORKSPACE_ID) for o in data],
+               *[page[column] for column, _ in store_columns],
+               [json.dumps(o, separators=(',', ':')) for o in data])
+
+    with connection:
+        connection.executemany(upsert, rows)
+
+
+def query_logs(connection=None, sql=None, parameters=()):
+    return [json.loads(record) for record, in connection.execute(sql, parameters)]
+
+
+def conversation_turns(connection=None, conversation_id=None):
+    """ The logs of one conversation, in request order. """
+    return query_logs(connection, 'select record from logs where conversation_id = ? order by request_timestamp',
+                      (conversation_id,))
+
+
+def find_logs(connection=None, intent=None, exit_reason=None, start=None, end=None):
+    """ Logs with a top intent and/or exit reason, with a request_timestamp from start up to end, in request order.
+    start and end are ISO 8601 text like the API writes, and can be cut short, as in 2020-04-07.
+    """
+    clauses = []
+    parameters = []
+    for column, value in [('intent', intent), ('exit_reason', exit_reason)]:
+        if value is not None:
+            clauses.append(f'{column} = ?')
+            parameters.append(value)
+    if start is not None:
+        clauses.append('request_timestamp >= ?')
+        parameters.append(start)
+    if end is not None:
+        clauses.append('request_timestamp < ?')
+        parameters.append(end)
+
+    where = ' where ' + ' and '.join(clauses) if clauses else ''
+    return query_logs(connection, f'select record from logs{where} order by request_timestamp', parameters)
@@ -0,0 +1,229 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Single pass summary of Watson Assistant logs.
+
+LogSummary is fed one page at a time and keeps only counters, so memory does not
+grow with the number of logs. Latency quantiles come from a log bucketed sketch
+with a fixed relative error. Turns per conversation are worked out from
+dialog_turn_counter: every conversation with at least k turns logs exactly one
+turn k, so no conversation IDs need to be remembered.
+"""
+
+import csv
+import json
+import math
+from datetime import datetime
+from wa_logs.flatten import (c_BRANCH_EXITED_REASON, c_CONFIDENCE, c_CONTEXT, c_INTENT, c_INTENTS, c_RESPONSE,
+                             c_SYSTEM, c_UTC_SUFFIX, f_request_timestamp, f_response_timestamp, parse_timestamp)
+
+c_DIALOG_TURN_COUNTER = 'dialog_turn_counter'
+
+# Key used for logs without an intent or exit reason. Intent names cannot contain brackets.
+c_NONE = '(none)'
+
+default_relative_accuracy = 0.01
+default_quantiles = [0.5, 0.9, 0.95, 0.99]
+confidence_bins = 10
+
+
+class QuantileSketch:
+    """ Streaming quantiles of positive values, accurate to within relative_accuracy.
+
+    Values are counted in buckets whose bounds grow geometrically, so memory depends
+    on the spread of the values rather than on how many there are.
+    """
+
+    def __init__(self, relative_accuracy=default_relative_accuracy):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value=None):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+        if value <= 0:
+            self.zeros += 1
+            return
+        key = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def quantile(self, q=None):
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return min(self.min, 0)
+
+        seen = self.zeros
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                # The middle of the bucket, in relative terms.
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def report(self, quantiles=default_quantiles, digits=1):
+        if self.count == 0:
+            return {'count': 0}
+
+        report = {'count': self.count, 'min': round(self.min, digits), 'mean': round(self.total / self.count, digits)}
+        for q in quantiles:
+            report['p{:g}'.format(q * 100)] = round(self.quantile(q), digits)
+        report['max'] = round(self.max, digits)
+        return report
+
+
+def latency_ms(request_timestamp=None, response_timestamp=None):
+    """ Milliseconds between two API timestamps. """
+    # Plain UTC timestamps skip the time zone handling, which is most of the cost.
+    if request_timestamp.endswith(c_UTC_SUFFIX) and response_timestamp.endswith(c_UTC_SUFFIX):
+        delta = datetime.fromisoformat(response_timestamp[:-1]) - datetime.fromisoformat(request_timestamp[:-1])
+    else:
+        delta = parse_timestamp(response_timestamp) - parse_timestamp(request_timestamp)
+    return delta.total_seconds() * 1000
+
+
+class LogSummary:
+    """ Aggregates pages of log records into the numbers most exports are pulled for:
+    intent counts, a confidence histogram, exit reasons, turns per conversation and latency.
+    """
+
+    def __init__(self, relative_accuracy=default_relative_accuracy):
+        self.records = 0
+        self.first = None
+        self.last = None
+        self.intents = {}
+        self.exit_reasons = {}
+        self.confidence = [0] * confidence_bins
+        self.confidence_total = 0.0
+        self.turns = {}
+        self.latency = QuantileSketch(relative_accuracy=relative_accuracy)
+
+    def add_page(self, data=None):
+        intents = self.intents
+        exit_reasons = self.exit_reasons
+        confidence = self.confidence
+        turns = self.turns
+
+        for o in data:
+            self.records += 1
+            response_timestamp = o[f_response_timestamp]
+            if self.first is None or response_timestamp < self.first:
+                self.first = response_timestamp
+            if self.last is None or response_timestamp > self.last:
+                self.last = response_timestamp
+
+            r = o[c_RESPONSE]
+            top = r[c_INTENTS][0] if r[c_INTENTS] else None
+            if top is not None:
+                intents[top[c_INTENT]] = intents.get(top[c_INTENT], 0) + 1
+                score = top[c_CONFIDENCE]
+                confidence[min(int(score * confidence_bins), confidence_bins - 1)] += 1
+                self.confidence_total += score
+            else:
+                intents[c_NONE] = intents.get(c_NONE, 0) + 1
+
+            system = r[c_CONTEXT].get(c_SYSTEM, {})
+            reason = system.get(c_BRANCH_EXITED_REASON) or c_NONE
+            exit_reasons[reason] = exit_reasons.get(reason, 0) + 1
+
+            turn = system.get(c_DIALOG_TURN_COUNTER)
+            if turn is not None:
+                turns[turn] = turns.get(turn, 0) + 1
+
+            self.latency.add(latency_ms(o[f_request_timestamp], response_timestamp))
+
+    def conversation_lengths(self):
+        # Conversations with exactly k turns are those with a turn k but no turn k+1. An export
+        # that starts part way into a conversation can make this slightly negative, so clamp it.
+        lengths = {}
+        for turn in sorted(self.turns):
+            length = self.turns[turn] - self.turns.get(turn + 1, 0)
+            if length > 0:
+                lengths[turn] = length
+        return lengths
+
+    def report(self):
+        """ The summary as a dict that can be written as JSON. """
+        with_intent = sum(self.confidence)
+        lengths = self.conversation_lengths()
+        conversations = sum(lengths.values())
+
+        return {
+            'records': self.records,
+            f'first_{f_response_timestamp}': self.first,
+            f'last_{f_response_timestamp}': self.last,
+            'intents': dict(sorted(self.intents.items(), key=lambda item: (-item[1], item[0]))),
+            'confidence': {
+                'count': with_intent,
+                'mean': round(self.confidence_total / with_intent, 4) if with_intent else None,
+                'histogram': [{'from': i / confidence_bins, 'to': (i + 1) / confidence_bins, 'count': n}
+                              for i, n in enumerate(self.confidence)]
+            },
+            'exit_reasons': dict(sorted(self.exit_reasons.items(), key=lambda item: (-item[1], item[0]))),
+            'turns': {
+                'conversations': conversations,
+                'mean_turns': round(sum(k * n for k, n in lengths.items()) / conversations, 2) if conversations else None,
+                'logs_by_turn': dict((str(k), self.turns[k]) for k in sorted(self.turns)),
+                'conversations_by_turns': dict((str(k), n) for k, n in lengths.items())
+            },
+            'latency_ms': self.latency.report()
+        }
+
+    def rows(self):
+        """ The summary as (metric, key, value) rows for a CSV/TSV file. """
+        report = self.report()
+        yield 'records', '', report['records']
+        yield f'first_{f_response_timestamp}', '', report[f'first_{f_response_timestamp}']
+        yield f'last_{f_response_timestamp}', '', report[f'last_{f_response_timestamp}']
+        for intent, n in report['intents'].items():
+            yield 'intent', intent, n
+        yield 'confidence', 'count', report['confidence']['count']
+        yield 'confidence', 'mean', report['confidence']['mean']
+        for bucket in report['confidence']['histogram']:
+            yield 'confidence_histogram', '{:.1f}-{:.1f}'.format(bucket['from'], bucket['to']), bucket['count']
+        for reason, n in report['exit_reasons'].items():
+            yield 'exit_reason', reason, n
+        yield 'turns', 'conversations', report['turns']['conversations']
+        yield 'turns', 'mean_turns', report['turns']['mean_turns']
+        for k, n in report['turns']['logs_by_turn'].items():
+            yield 'logs_by_turn', k, n
+        for k, n in report['turns']['conversations_by_turns'].items():
+            yield 'conversations_by_turns', k, n
+        for k, v in report['latency_ms'].items():
+            yield 'latency_ms', k, v
+
+
+def save_summary(summary=None, file_name=None, sep=None):
+    """ Writes the summary as JSON, or as metric,key,value rows if sep is given. """
+    if sep is None:
+        with open(file_name, 'w') as out:
+            json.dump(summary.report(), out, indent=2)
+        return
+
+    with open(file_name, 'w', newline='') as out:
+        writer = csv.writer(out, delimiter=sep)
+        writer.writerow(['metric', 'key', 'value'])
+        writer.writerows(('' if v is None else v for v in row) for row in summary.rows())
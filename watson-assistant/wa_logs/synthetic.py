@@ -0,0 +1,144 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Synthetic Watson Assistant log records for testing and benchmarking.
+
+Every record is built from its index alone, so any slice of a log set of any
+size can be produced on demand without keeping the rest in memory. Records
+follow the shape returned by list_logs / list_all_logs, and response
+timestamps go up with the index.
+"""
+
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from wa_logs.flatten import format_timestamp
+
+default_start = datetime(2020, 4, 1, tzinfo=timezone.utc)
+default_interval_ms = 250
+
+default_intents = [
+    'greeting', 'goodbye', 'thanks', 'order_status', 'cancel_order', 'reset_password',
+    'store_hours', 'talk_to_agent', 'billing_question', 'update_address'
+]
+
+exit_reasons = ['completed', 'fallback', 'completed', 'completed']
+
+
+def workspace_intents(file_name=None):
+    """ Intent names from a workspace JSON export, for realistic intent values. """
+    with open(file_name) as f:
+        return [intent['intent'] for intent in json.load(f)['intents']]
+
+
+class LogSet:
+    """ A virtual, read only list of log records.
+
+    count records, spaced interval_ms apart from start. Conversations of turns
+    turns each run active at a time, interleaved the way real traffic is.
+    context_size adds that many skill variables to every context, to mimic
+    the large contexts of real assistants.
+    """
+
+    def __init__(self, count=10000, start=default_start, interval_ms=default_interval_ms, intents=None,
+                 turns=4, active=50, context_size=20, workspace_id='synthetic-workspace', seed=0):
+        self.count = count
+        self.start = start
+        self.interval_ms = interval_ms
+        self.intents = intents or default_intents
+        self.turns = turns
+        self.active = active
+        self.context_size = context_size
+        self.workspace_id = workspace_id
+        self.seed = seed
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return self.make_log(index)
+
+    def response_timestamp(self, index=0):
+        return format_timestamp(self.start + timedelta(milliseconds=index * self.interval_ms))
+
+    def make_log(self, index=0):
+        rng = random.Random(self.seed * 1000003 + index)
+
+        block = self.active * self.turns
+        conversation = (index // block) * self.active + index % self.active
+        turn = (index % block) // self.active + 1
+        conversation_id = 'conv-{:08d}'.format(conversation)
+
+        responded = self.start + timedelta(milliseconds=index * self.interval_ms)
+        requested = responded - timedelta(milliseconds=rng.randint(40, 900))
+
+        intents = []
+        if rng.random() > 0.15:
+            intents = [{'intent': rng.choice(self.intents), 'confidence': round(rng.uniform(0.2, 1.0), 6)}]
+
+        text = 'synthetic utterance {} of conversation {}'.format(turn, conversation)
+        output = ['Synthetic response to turn {}.'.format(turn)]
+        system = {
+            'initialized': True,
+            'dialog_stack': [{'dialog_node': 'root'}],
+            'dialog_turn_counter': turn,
+            'dialog_request_counter': turn,
+            '_node_output_map': {'node_{}'.format(turn): {'0': [0]}},
+        }
+        if turn == self.turns:
+            system['branch_exited'] = True
+            system['branch_exited_reason'] = rng.choice(exit_reasons)
+
+        context = {
+            'conversation_id': conversation_id,
+            'system': system,
+            'metadata': {'user_id': 'user-{}'.format(conversation % 997), 'deployment': 'synthetic'},
+        }
+        for i in range(self.context_size):
+            context['skill_variable_{}'.format(i)] = 'value {} for {}'.format(i, conversation_id)
+
+        response = {
+            'input': {'text': text},
+            'intents': intents,
+            'entities': [],
+            'output': {'text': output, 'nodes_visited': ['node_{}'.format(turn)], 'log_messages': [],
+                       'generic': [{'response_type': 'text', 'text': output[0]}]},
+            'context': context,
+        }
+
+        return {
+            'log_id': '{:08x}-0000-4000-8000-{:012x}'.format(self.seed, index),
+            'request': {'input': {'text': text}, 'context': {'conversation_id': conversation_id,
+                                                              'metadata': context['metadata']}},
+            'response': response,
+            'request_timestamp': format_timestamp(requested),
+            'response_timestamp': format_timestamp(responded),
+            'workspace_id': self.workspace_id,
+            'language': 'en',
+        }
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self.make_log(index)
+
+    def pages(self, page_limit=200):
+        """ Yields the records in pages, the way the exporters receive them. """
+        for first in range(0, self.count, page_limit):
+            yield self[first:first + page_limit]
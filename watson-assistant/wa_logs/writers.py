@@ -0,0 +1,466 @@
+# Copyright 2020 IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Output writers for exported logs.
+
+save_json, save_xsv and save_xlsx write a whole export at once. The JSONL and
+PARQUET writers, and XlsxStreamWriter, are opened before the download and take
+one page at a time, so only a page is held in memory.
+
+The PageWriter classes wrap these behind one interface: add_page() for each page
+as it downloads, then close() once the download is done, or abort() if it fails.
+"""
+
+import csv
+import gzip
+import importlib.util
+import json
+import logging
+from wa_logs.flatten import (columns, convert_json_to_dataframe, flatten_pages, parse_timestamp, f_conversation_id,
+                             f_request_timestamp, f_response_timestamp, f_user_input, f_output, f_intent,
+                             f_confidence, f_exit_reason, f_logging, f_context, csv_rows, xlsx_rows)
+from wa_logs.extsort import ExternalSorter
+from wa_logs.metrics import c_FLATTEN, c_SORT, c_WRITE, timed
+from wa_logs.store import open_store, save_store_page
+from wa_logs.summary import LogSummary, save_summary
+
+# Excel's rows per sheet, less the header row.
+xlsx_max_rows = 1048575
+
+logger = logging.getLogger(__name__)
+
+
+def require(*packages):
+    """ Raises ImportError for the first of packages that is not installed, before any logs are downloaded. """
+    for package in packages:
+        if importlib.util.find_spec(package) is None:
+            raise ImportError(f'No module named {package!r}', name=package)
+
+
+def sheet_name(index=0):
+    return 'Sheet{}'.format(index + 1)
+
+
+def save_json(data=None, file_name=None):
+    with open(file_name, 'w') as out:
+        json.dump(data, out)
+
+
+def open_jsonl(file_name=None, compress=False, append=False):
+    mode = 'a' if append else 'w'
+    if compress:
+        # Appending to a gzip file adds a new member, which readers treat as one stream.
+        return gzip.open(file_name, mode + 't', encoding='utf8')
+    return open(file_name, mode, encoding='utf8')
+
+
+def save_jsonl_page(data=None, out=None):
+    for record in data:
+        out.write(json.dumps(record))
+        out.write('\n')
+
+    # Flush per page so an interrupted run keeps everything downloaded so far.
+    out.flush()
+
+
+def save_xsv(data=None, sep=',', file_name=None, strip=False, context=True, metrics=None):
+    df = convert_json_to_dataframe(data, strip=strip, context=context, metrics=metrics)
+    if df is not None:
+        with timed(metrics, c_WRITE):
+            df.to_csv(file_name, encoding='utf8', sep=sep, index=False)
+
+
+def save_xsv_sorted(sorter=None, sep=',', file_name=None, header=columns, skip=0):
+    """ Writes the rows of an ExternalSorter, which come out already sorted, leaving off
+    the first skip values of each row.
+    """
+    if sorter.count == 0:
+        logger.warning('No Logs found. :(')
+        return
+
+    with open(file_name, 'w', encoding='utf8', newline='') as out:
+        writer = csv.writer(out, delimiter=sep, lineterminator='\n')
+        writer.writerow(header)
+        writer.writerows((row[skip:] for row in sorter) if skip else sorter)
+
+
+def save_xlsx(data=None, file_name=None, strip=False, context=True, metrics=None):
+    df = convert_json_to_dataframe(data, strip=strip, parse_dates=False, context=context, metrics=metrics)
+    if df is not None:
+        import pandas as pd
+
+        # Carry on into a new sheet whenever one is full.
+        with timed(metrics, c_WRITE), pd.ExcelWriter(file_name) as writer:
+            for sheet, first in enumerate(range(0, len(df), xlsx_max_rows)):
+                df.iloc[first:first + xlsx_max_rows].to_excel(writer, sheet_name=sheet_name(sheet), index=False)
+
+
+def to_number(value=None):
+    """ Turns the text of a number back into an int or float. Anything else is left as it is. """
+    if not isinstance(value, str) or not value:
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def numeric_columns(rows=None, skip=0):
+    """ Indexes, less skip, of the columns that hold an int or float in any of rows. """
+    found = set()
+    for row in rows:
+        for i, value in enumerate(row[skip:]):
+            if value.__class__ is int or value.__class__ is float:
+                found.add(i)
+    return found
+
+
+class XlsxStreamWriter:
+    """ Writes XLSX rows as they arrive, with constant memory.
+
+    Uses the write only mode of openpyxl, which streams each sheet to disk. A new
+    sheet is started whenever max_rows rows have been written to the current one.
+    Values in the numeric columns, a set of indexes, are written as numbers even
+    if they arrive as text. Raises ImportError without openpyxl.
+    """
+
+    def __init__(self, file_name=None, max_rows=xlsx_max_rows, header=columns):
+        from openpyxl import Workbook
+
+        self.file_name = file_name
+        self.max_rows = max_rows
+        self.header = header
+        self.workbook = Workbook(write_only=True)
+        self.sheet = None
+        self.sheets = 0
+        self.sheet_rows = 0
+        self.count = 0
+        self.numeric = {columns.index(f_confidence)} if header is columns else set()
+
+    def new_sheet(self):
+        self.sheet = self.workbook.create_sheet(sheet_name(self.sheets))
+        self.sheet.append(self.header)
+        self.sheets += 1
+        self.sheet_rows = 0
+
+    def add_rows(self, rows=None):
+        for row in rows:
+            if self.sheet is None or self.sheet_rows >= self.max_rows:
+                self.new_sheet()
+
+            # Rows that went through an on disk sort come back as text.
+            for i in self.numeric:
+                if isinstance(row[i], str):
+                    row = list(row)
+                    for j in self.numeric:
+                        row[j] = to_number(row[j])
+                    break
+
+            self.sheet.append(row)
+            self.sheet_rows += 1
+            self.count += 1
+
+    def close(self):
+        if self.sheet is None:
+            self.new_sheet()
+        self.workbook.save(self.file_name)
+
+
+def open_parquet(file_name=None):
+    """ Opens a Parquet file for writing page by page. Raises ImportError without pyarrow. """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    text = pa.string()
+    timestamp = pa.timestamp('ms', tz='UTC')
+    schema = pa.schema([
+        (f_conversation_id, text), (f_request_timestamp, timestamp), (f_response_timestamp, timestamp),
+        (f_user_input, text), (f_output, text), (f_intent, text), (f_confidence, pa.float64()),
+        (f_exit_reason, text), (f_logging, text), (f_context, text)
+    ])
+    return pq.ParquetWriter(file_name, schema)
+
+
+def save_parquet_page(data=None, writer=None, strip=False, context=True, metrics=None):
+    import pyarrow as pa
+
+    if len(data) == 0:
+        return
+
+    # One write per page gives one row group per page, so memory stays at one page.
+    with timed(metrics, c_FLATTEN):
+        page = flatten_pages([data], strip=strip, context=context, missing=None)
+        page[f_logging] = [None if v is None else json.dumps(v) for v in page[f_logging]]
+        page[f_request_timestamp] = [parse_timestamp(ts) for ts in page[f_request_timestamp]]
+        page[f_response_timestamp] = [parse_timestamp(ts) for ts in page[f_response_timestamp]]
+    with timed(metrics, c_WRITE):
+        writer.write_table(pa.Table.from_pydict(page, schema=writer.schema))
+
+
+def conversation_order(row=None):
+    """ Sort key for flattened rows: by conversation ID, and then request. """
+    return row[0], row[1]
+
+
+class PageWriter:
+    """ Takes an export one page at a time.
+
+    checkpoint is True if every page is safely on disk once add_page() returns,
+    so that an interrupted export can carry on after it. metrics, if set to an
+    ExportMetrics from wa_logs/metrics.py, gets the time spent in each stage.
+    """
+
+    checkpoint = False
+    metrics = None
+
+    def add_page(self, data=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+class JsonWriter(PageWriter):
+    """ Keeps the pages and writes them as one JSON list of pages. """
+
+    def __init__(self, file_name=None):
+        self.file_name = file_name
+        self.pages = []
+
+    def add_page(self, data=None):
+        self.pages.append(data)
+
+    def close(self):
+        with timed(self.metrics, c_WRITE):
+            save_json(data=self.pages, file_name=self.file_name)
+
+
+class JsonlWriter(PageWriter):
+    """ Writes one log per line as pages arrive, or just its projected columns. """
+
+    checkpoint = True
+
+    def __init__(self, file_name=None, compress=False, append=False, projection=None):
+        self.out = open_jsonl(file_name=file_name, compress=compress, append=append)
+        self.projection = projection
+
+    def add_page(self, data=None):
+        if self.projection is not None:
+            with timed(self.metrics, c_FLATTEN):
+                data = self.projection.records(data)
+        with timed(self.metrics, c_WRITE):
+            save_jsonl_page(data=data, out=self.out)
+
+    def close(self):
+        self.out.close()
+
+    def abort(self):
+        # Everything written so far is complete and flushed, so keep it.
+        self.out.close()
+
+
+class ParquetWriter(PageWriter):
+    """ Writes a row group per page. Raises ImportError without pyarrow. """
+
+    @staticmethod
+    def packages():
+        """ The optional packages this writer needs. """
+        return ['pyarrow']
+
+    def __init__(self, file_name=None, strip=False, context=True):
+        require(*self.packages())
+        self.writer = open_parquet(file_name=file_name)
+        self.strip = strip
+        self.context = context
+
+    def add_page(self, data=None):
+        save_parquet_page(data=data, writer=self.writer, strip=self.strip, context=self.context, metrics=self.metrics)
+
+    def close(self):
+        with timed(self.metrics, c_WRITE):
+            self.writer.close()
+
+    def abort(self):
+        self.writer.close()
+
+
+class XsvWriter(PageWriter):
+    """ Writes CSV/TSV sorted by conversation. With sort_memory (in bytes) the rows
+    are sorted on disk instead of in one DataFrame. A projection picks the columns
+    instead of the standard ones. Sorting in a DataFrame raises ImportError without pandas.
+    """
+
+    @staticmethod
+    def packages(sort_memory=None, projection=None):
+        """ The optional packages this writer needs with these options. """
+        return [] if sort_memory is not None or projection is not None else ['pandas']
+
+    def __init__(self, file_name=None, sep=',', strip=False, context=True, sort_memory=None, temp_dir=None,
+                 projection=None):
+        require(*self.packages(sort_memory=sort_memory, projection=projection))
+        self.file_name = file_name
+        self.sep = sep
+        self.strip = strip
+        self.context = context
+        self.projection = projection
+        self.pages = []
+        self.sorter = None
+        if sort_memory is not None or projection is not None:
+            self.sorter = ExternalSorter(key=conversation_order, memory=sort_memory or float('inf'), temp_dir=temp_dir)
+
+    def add_page(self, data=None):
+        if self.sorter is None:
+            self.pages.append(data)
+            return
+
+        with timed(self.metrics, c_FLATTEN):
+            if self.projection is not None:
+                rows = self.projection.sort_rows(data)
+            else:
+                rows = csv_rows(data, strip=self.strip, context=self.context)
+        with timed(self.metrics, c_SORT):
+            self.sorter.add(rows)
+
+    def close(self):
+        if self.sorter is None:
+            save_xsv(data=self.pages, sep=self.sep, file_name=self.file_name, strip=self.strip, context=self.context,
+                     metrics=self.metrics)
+            return
+
+        # The last merge of the sorted runs happens as the rows are written.
+        with self.sorter, timed(self.metrics, c_WRITE):
+            if self.projection is not None:
+                save_xsv_sorted(sorter=self.sorter, sep=self.sep, file_name=self.file_name,
+                                header=self.projection.names, skip=2)
+            else:
+                save_xsv_sorted(sorter=self.sorter, sep=self.sep, file_name=self.file_name)
+
+    def abort(self):
+        if self.sorter is not None:
+            self.sorter.close()
+
+
+class XlsxWriter(PageWriter):
+    """ Writes XLSX sorted by conversation, through pandas by default.
+
+    With stream, rows go straight to the workbook in download order with constant
+    memory. With sort_memory (in bytes) they are sorted on disk, then streamed.
+    A projection picks the columns instead of the standard ones, and is always
+    streamed. Raises ImportError without openpyxl, or without pandas when not streamed.
+    """
+
+    @staticmethod
+    def packages(stream=False, sort_memory=None, projection=None):
+        """ The optional packages this writer needs with these options. """
+        if stream or sort_memory is not None or projection is not None:
+            return ['openpyxl']
+        return ['pandas', 'openpyxl']
+
+    def __init__(self, file_name=None, strip=False, context=True, stream=False, sort_memory=None, temp_dir=None,
+                 projection=None):
+        require(*self.packages(stream=stream, sort_memory=sort_memory, projection=projection))
+        self.file_name = file_name
+        self.strip = strip
+        self.context = context
+        self.projection = projection
+        self.pages = []
+        self.sorter = None
+        self.xlsx = None
+        if stream or sort_memory is not None or projection is not None:
+            self.xlsx = XlsxStreamWriter(file_name=file_name,
+                                         header=projection.names if projection is not None else columns)
+        if sort_memory is not None or (projection is not None and not stream):
+            self.sorter = ExternalSorter(key=conversation_order, memory=sort_memory or float('inf'), temp_dir=temp_dir)
+
+    def add_page(self, data=None):
+        if self.xlsx is None:
+            self.pages.append(data)
+            return
+
+        with timed(self.metrics, c_FLATTEN):
+            if self.projection is not None and self.sorter is not None:
+                rows = self.projection.sort_rows(data)
+                # Note the number columns while the values still have their types.
+                self.xlsx.numeric |= numeric_columns(rows, skip=2)
+            elif self.projection is not None:
+                rows = self.projection.rows(data)
+            else:
+                rows = xlsx_rows(data, strip=self.strip, context=self.context)
+
+        if self.sorter is not None:
+            with timed(self.metrics, c_SORT):
+                self.sorter.add(rows)
+        else:
+            with timed(self.metrics, c_WRITE):
+                self.xlsx.add_rows(rows)
+
+    def close(self):
+        if self.xlsx is None:
+            save_xlsx(data=self.pages, file_name=self.file_name, strip=self.strip, context=self.context,
+                      metrics=self.metrics)
+            return
+
+        with timed(self.metrics, c_WRITE):
+            if self.sorter is not None:
+                with self.sorter:
+                    self.xlsx.add_rows((row[2:] for row in self.sorter) if self.projection is not None else self.sorter)
+            self.xlsx.close()
+
+    def abort(self):
+        if self.sorter is not None:
+            self.sorter.close()
+
+
+class SqliteWriter(PageWriter):
+    """ Upserts pages into a SQLite log store, see wa_logs/store.py. """
+
+    checkpoint = True
+
+    def __init__(self, file_name=None):
+        self.connection = open_store(file_name)
+
+    def add_page(self, data=None):
+        with timed(self.metrics, c_WRITE):
+            save_store_page(data=data, connection=self.connection)
+
+    def close(self):
+        self.connection.close()
+
+    def abort(self):
+        # Every page written so far is committed, so keep it.
+        self.connection.close()
+
+
+class SummaryWriter(PageWriter):
+    """ Writes a LogSummary of the logs instead of the logs, as JSON or as CSV/TSV rows if sep is given. """
+
+    def __init__(self, file_name=None, sep=None):
+        self.file_name = file_name
+        self.sep = sep
+        self.summary = LogSummary()
+
+    def add_page(self, data=None):
+        with timed(self.metrics, c_FLATTEN):
+            self.summary.add_page(data)
+
+    def close(self):
+        with timed(self.metrics, c_WRITE):
+            save_summary(summary=self.summary, file_name=self.file_name, sep=self.sep)